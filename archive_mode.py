@@ -0,0 +1,96 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import program_errors
+import sys
+import weather_forecast
+import weather_utils
+
+
+def process_forecast_file(file_name: str, queries: list) -> list[str]:
+    '''answers the queries against one saved forecast file, or returns the
+    failure message if the file is missing or badly formatted. A query the
+    file can't answer (like one whose values are all missing) fails just
+    this file, the same way batch_mode fails just one job. Only the fields
+    and periods the queries need are read from the file'''
+    try:
+        weather_finder = weather_forecast.WeatherForecastWithFile(file_name,
+            selective=True, max_periods=get_max_length(queries))
+        return weather_utils.process_queries(queries, weather_finder)
+    except program_errors.FileFailureError as e:
+        return e.get_failure_message()
+    except (IndexError, ValueError) as e:
+        return ['FAILED', 'INPUT', f'{type(e).__name__}: {e}']
+
+def get_max_length(queries: list) -> int:
+    '''returns the most periods any of the queries looks at, or None if a
+    query can't be read (it will fail on its own later)'''
+    try:
+        return max((weather_utils.parse_query(query)[3] for query in queries),
+                   default=0)
+    except (IndexError, ValueError):
+        return None
+
+def reprocess_files(file_names, queries: list, max_workers: int = None,
+                    chunk_size: int = None) -> list[tuple]:
+    '''answers the same queries against many saved forecast files using a
+    pool of processes. Files are handed to the workers chunk_size at a time
+    (by default about four chunks per worker) and the results come back as
+    (file name, output lines) in the same order as file_names'''
+    file_names = list(file_names)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(file_names)))
+
+    if max_workers == 1:
+        #not worth starting processes for
+        return [(file_name, process_forecast_file(file_name, queries))
+                for file_name in file_names]
+
+    if chunk_size is None:
+        chunk_size = max(1, len(file_names) // (max_workers * 4))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        results = executor.map(process_forecast_file, file_names,
+                               itertools.repeat(queries),
+                               chunksize=chunk_size)
+        return list(zip(file_names, results))
+
+def read_queries(file_name: str) -> list[str]:
+    '''reads one query per line, stopping at 'NO MORE QUERIES' if it is
+    there'''
+    queries = []
+    with open(file_name, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line == 'NO MORE QUERIES':
+                break
+            if line != '':
+                queries.append(line)
+    return queries
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='answers a set of queries against saved nws forecasts')
+    parser.add_argument('queries_file',
+        help='file with one query per line')
+    parser.add_argument('forecast_files', nargs='+',
+        help='saved nws hourly forecast json files')
+    parser.add_argument('--workers', type=int, default=None,
+        help='number of processes, one per cpu by default')
+    parser.add_argument('--chunk-size', type=int, default=None,
+        help='number of files handed to a process at a time')
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries_file)
+    for file_name, output_lines in reprocess_files(args.forecast_files,
+            queries, args.workers, args.chunk_size):
+        sys.stdout.write(json.dumps({'file': file_name,
+                                     'output': output_lines}))
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
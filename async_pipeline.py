@@ -0,0 +1,285 @@
+import asyncio
+import class_utils
+import concurrent.futures
+import forecast_cache
+import functools
+import gazetteer
+import geocoding
+import instrumentation
+import place_index
+import program_errors
+import urllib.parse
+import urllib.request
+import user_interface
+import weather_forecast
+
+
+class AsyncSession:
+    '''sends requests from asyncio code. Each request runs send_request in a
+    worker thread of executor (the loop's default executor if it is None) so
+    it can use the connection pool and response cache, and at most
+    max_per_host requests go to the same host at a time'''
+    def __init__(self, max_per_host: int = 4, response_cache=None,
+                 executor: concurrent.futures.Executor = None):
+        self.max_per_host = max_per_host
+        self.response_cache = response_cache
+        self.executor = executor
+        self._host_limits = {}
+
+    async def send(self, request: urllib.request.Request,
+                   use_response_cache: bool = False,
+                   retry_policy=None, rate_limiter=None) -> tuple:
+        '''sends request and returns (json data, url) like send_request,
+        retrying as retry_policy says. A rate_limiter token is taken once
+        the request has a slot for its host, right before it is sent, so
+        requests that waited for a slot still go out spaced apart'''
+        host = urllib.parse.urlsplit(request.full_url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+
+        response_cache = self.response_cache if use_response_cache else None
+        async with self._host_limits[host]:
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async()
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(class_utils.send_request,
+                    request, response_cache=response_cache,
+                    retry_policy=retry_policy))
+
+
+class AsyncForwardGeocodingWithApi(geocoding.ForwardGeocodingWithApi):
+    '''ForwardGeocodingWithApi that gets its data with await load() instead
+    of blocking in __init__'''
+    def __init__(self, target: str, session: AsyncSession, cache=None):
+        super().__init__(target, cache=cache, load=False)
+        self.session = session
+
+    async def load(self) -> 'AsyncForwardGeocodingWithApi':
+        with instrumentation.span('geocoding.forward'):
+            self.json_data, self.url = await self.get_json_data_async()
+        return self
+
+    async def get_json_data_async(self) -> tuple:
+        '''same as get_json_data but waits for the rate limiter and the server
+        without blocking other tasks'''
+        json_data = self._get_cached_json_data()
+        if json_data is not None:
+            return json_data
+
+        url = self._make_url(self.target)
+        request = self._make_request(url)
+        json_data = await self.session.send(request,
+                                            retry_policy=self.RETRY_POLICY,
+                                            rate_limiter=self.RATE_LIMITER)
+
+        self._cache_json_data(json_data)
+        return json_data
+
+
+class AsyncReverseGeocodingWithApi(geocoding.ReverseGeocodingWithApi):
+    '''ReverseGeocodingWithApi that gets its data with await load() instead
+    of blocking in __init__'''
+    def __init__(self, coordinates: tuple, session: AsyncSession, cache=None):
+        super().__init__(coordinates, cache=cache, load=False)
+        self.session = session
+
+    async def load(self) -> 'AsyncReverseGeocodingWithApi':
+        with instrumentation.span('geocoding.reverse'):
+            self.json_data, self.url = await self.get_json_data_async()
+        return self
+
+    async def get_json_data_async(self) -> tuple:
+        '''same as get_json_data but waits for the rate limiter and the server
+        without blocking other tasks'''
+        json_data = self._get_cached_json_data()
+        if json_data is not None:
+            return json_data
+
+        url = self._make_url(self.lat, self.lon)
+        request = self._make_request(url)
+        json_data = await self.session.send(request,
+                                            retry_policy=self.RETRY_POLICY,
+                                            rate_limiter=self.RATE_LIMITER)
+
+        self._cache_json_data(json_data)
+        return json_data
+
+
+class AsyncWeatherForecastWithApi(weather_forecast.WeatherForecastWithApi):
+    '''WeatherForecastWithApi that gets its data with await load() instead of
+    blocking in __init__. With a forecast cache, targets in the same grid
+    share one fetch, like the threads of WeatherForecastWithApi do'''
+    def __init__(self, latitude, longitude, session: AsyncSession,
+                 grid_cache=None, forecast_cache=None):
+        super().__init__(latitude, longitude, grid_cache=grid_cache,
+                         response_cache=session.response_cache,
+                         forecast_cache=forecast_cache, load=False)
+        self.session = session
+
+    async def load(self) -> 'AsyncWeatherForecastWithApi':
+        with instrumentation.span('forecast.fetch'):
+            self.json_data, self.url = await self.get_json_data_async()
+        return self
+
+    async def get_json_data_async(self) -> tuple:
+        '''same as get_json_data, including the grid cache and dropping a
+        cached url that gets a 404, but without blocking other tasks'''
+        new_url, from_cache = await self.get_forecast_url_async()
+
+        try:
+            json_data, polygon = await self._get_forecast_async(new_url)
+        except program_errors.ApiFailureError as e:
+            if not from_cache or e.status_code != 404:
+                raise
+            self.grid_cache.delete(self._make_cache_key())
+            new_url, from_cache = await self.get_forecast_url_async()
+            json_data, polygon = await self._get_forecast_async(new_url)
+
+        if not from_cache:
+            self._cache_grid(new_url, polygon)
+        return json_data
+
+    async def _get_forecast_async(self, new_url: str) -> tuple:
+        '''same as _get_forecast but without blocking other tasks'''
+        if self.forecast_cache is None:
+            json_data = await self.session.send(self._make_request(new_url),
+                                                True)
+            return (json_data, weather_forecast._get_polygon(json_data[0]))
+
+        cached = await self.forecast_cache.get_async(new_url,
+            self._fetch_forecast_async)
+        return self._use_cached_forecast(new_url, cached)
+
+    async def _fetch_forecast_async(self, new_url: str
+                                    ) -> forecast_cache.CachedForecast:
+        json_data, url = await self.session.send(self._make_request(new_url),
+                                                 True)
+        return weather_forecast._make_cached_forecast(json_data, url)
+
+    async def get_forecast_url_async(self) -> tuple:
+        '''returns the forecastHourly url for the coordinates and whether it
+        came from the grid cache'''
+        new_url = self._get_cached_forecast_url()
+        if new_url is not None:
+            return (new_url, True)
+
+        url = self._make_url()
+        request = self._make_request(url)
+        json_data = await self.session.send(request, True)
+        return (self._get_forecast_url_from(json_data, request), False)
+
+
+async def create_objects_and_attributions(input_list: list,
+                                          session: AsyncSession,
+                                          caches: dict = None) -> tuple:
+    '''async version of user_interface.create_objects_and_attributions. Files
+    are still read with the normal classes since they don't wait on
+    anything'''
+    if caches is None:
+        caches = {}
+    user_interface.check_sources(input_list)
+
+    first_line = input_list[0].split()
+    if first_line[1] == 'NOMINATIM':
+        forward_geocoder = await AsyncForwardGeocodingWithApi(
+            ' '.join(first_line[2:]), session,
+            cache=caches.get('geocoding')).load()
+    elif first_line[1] == 'FILE':
+        forward_geocoder = geocoding.ForwardGeocodingWithFile(first_line[2])
+    elif first_line[1] == 'LOCAL':
+        target = ' '.join(first_line[3:])
+        index = place_index.open_place_index(first_line[2])
+        fallback = None
+        if index.find(target) is None:
+            fallback = await AsyncForwardGeocodingWithApi(target, session,
+                cache=caches.get('geocoding')).load()
+        forward_geocoder = geocoding.ForwardGeocodingWithIndex(target, index,
+            fallback=fallback)
+
+    second_line = input_list[1].split()
+    if second_line[1] == 'NWS':
+        latitude, longitude = forward_geocoder.get_coordinates()
+        weather_finder = await AsyncWeatherForecastWithApi(latitude,
+            longitude, session, grid_cache=caches.get('grid'),
+            forecast_cache=caches.get('forecasts')).load()
+    elif second_line[1] == 'FILE':
+        weather_finder = weather_forecast.WeatherForecastWithFile(
+            second_line[2])
+
+    last_line = input_list[-1].split()
+    if last_line[1] == 'NOMINATIM':
+        reverse_geocoder = await AsyncReverseGeocodingWithApi(
+            weather_finder.average_coordinates(), session,
+            cache=caches.get('geocoding')).load()
+    elif last_line[1] == 'FILE':
+        reverse_geocoder = geocoding.ReverseGeocodingWithFile(last_line[2])
+    elif last_line[1] == 'LOCAL':
+        coordinates = weather_finder.average_coordinates()
+        index = gazetteer.load_gazetteer(last_line[2])
+        reverse_geocoder = geocoding.ReverseGeocodingWithIndex(coordinates,
+            index, fallback=await _find_fallback(coordinates, index, session,
+                                                 caches))
+
+    return (forward_geocoder, weather_finder, reverse_geocoder,
+            user_interface.get_attribution_list(input_list,
+                user_interface.used_reverse_api(input_list, reverse_geocoder),
+                user_interface.used_forward_api(input_list,
+                                                forward_geocoder)))
+
+async def _find_fallback(coordinates: tuple, index, session: AsyncSession,
+                         caches: dict) -> AsyncReverseGeocodingWithApi:
+    '''loads the nominatim geocoder ReverseGeocodingWithIndex would fall back
+    to if the index has nothing close enough, or returns None'''
+    place, distance = index.find_nearest(*coordinates)
+    if (place is not None
+            and distance <= geocoding.ReverseGeocodingWithIndex.MAX_DISTANCE):
+        return None
+    return await AsyncReverseGeocodingWithApi(coordinates, session,
+        cache=caches.get('geocoding')).load()
+
+async def run_target(input_list: list, session: AsyncSession,
+                     caches: dict = None) -> list[str]:
+    '''returns the output lines for one target, the same lines run_program
+    would print, including the failure message if something goes wrong. Bad
+    input lines fail just this target, like batch_mode.run_job, so the other
+    targets of a batch still get their answers'''
+    try:
+        objects = await create_objects_and_attributions(input_list, session,
+                                                        caches)
+        return user_interface.make_output_list(input_list, objects)
+    except (program_errors.ApiFailureError,
+            program_errors.FileFailureError) as e:
+        return e.get_failure_message()
+    except (IndexError, KeyError, ValueError) as e:
+        return ['FAILED', 'INPUT', f'{type(e).__name__}: {e}']
+
+async def run_targets(input_lists, max_targets: int = 32,
+                      max_per_host: int = 4, caches: dict = None) -> list:
+    '''runs up to max_targets targets at once and returns the output lines
+    of each one, in the same order as input_lists'''
+    if caches is None:
+        caches = {}
+    target_limit = asyncio.Semaphore(max_targets)
+
+    #requests run in worker threads of their own, so there are enough of
+    #them for every host to use its full share without touching the loop's
+    #default executor
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(max_per_host * 3, 4),
+            thread_name_prefix='async-pipeline') as executor:
+        session = AsyncSession(max_per_host, caches.get('responses'),
+                               executor)
+
+        async def run_limited_target(input_list: list) -> list[str]:
+            async with target_limit:
+                return await run_target(input_list, session, caches)
+
+        return await asyncio.gather(*(run_limited_target(input_list)
+                                      for input_list in input_lists))
+
+def run_batch(input_lists, max_targets: int = 32, max_per_host: int = 4,
+              caches: dict = None) -> list:
+    '''runs many targets through the pipeline at once from normal code. Each
+    result is the list of lines make_output_list would give for that target'''
+    return asyncio.run(run_targets(list(input_lists), max_targets,
+                                   max_per_host, caches))
@@ -0,0 +1,177 @@
+import argparse
+import async_pipeline
+import asyncio
+import collections
+import instrumentation
+import json
+import sys
+import user_interface
+
+#error is set for a job that couldn't be read, which fails without running
+Job = collections.namedtuple('Job', ['job_id', 'input_list', 'error'],
+                             defaults=[None])
+
+
+def read_jobs(lines) -> 'generator':
+    '''yields a Job for every job in lines, one at a time so only the job
+    being read is kept in memory. Lines starting with '{' are json job specs,
+    either {"input": [...input lines...]} or {"target": "NOMINATIM ...",
+    "weather": "NWS", "queries": [...], "reverse": "NOMINATIM"}, with an
+    optional "id". Any other lines are read like get_input reads them: a job
+    ends one line after 'NO MORE QUERIES'. Blank lines between jobs are
+    skipped. A job that can't be read is yielded with its error, so it fails
+    on its own instead of stopping the batch'''
+    job_number = 0
+    input_list = []
+    expecting_last_line = False
+
+    for line in lines:
+        line = line.strip()
+        if line == '' and input_list == []:
+            continue
+
+        if input_list == [] and line.startswith('{'):
+            job_number += 1
+            yield read_json_job(line, job_number)
+            continue
+
+        input_list.append(line)
+        if expecting_last_line:
+            job_number += 1
+            yield Job(job_number, input_list)
+            input_list = []
+            expecting_last_line = False
+        elif line == 'NO MORE QUERIES':
+            expecting_last_line = True
+
+    if input_list != []:
+        yield Job(job_number + 1, input_list,
+                  f'ValueError: job {job_number + 1} ends before its REVERSE '
+                  'line')
+
+def read_json_job(line: str, job_number: int) -> Job:
+    '''reads one json job line, or returns a job holding the error if the
+    line isn't json or is missing part of the job'''
+    job_id = job_number
+    try:
+        job_spec = json.loads(line)
+        if isinstance(job_spec, dict):
+            job_id = job_spec.get('id', job_number)
+        return make_json_job(job_spec, job_number)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return Job(job_id, [], f'{type(e).__name__}: {e}')
+
+def make_json_job(job_spec: dict, job_number: int) -> Job:
+    '''turns a json job spec into a Job'''
+    job_id = job_spec.get('id', job_number)
+    if 'input' in job_spec:
+        return Job(job_id, list(job_spec['input']))
+
+    input_list = [f'TARGET {job_spec["target"]}',
+                  f'WEATHER {job_spec["weather"]}']
+    input_list += job_spec.get('queries', [])
+    input_list.append('NO MORE QUERIES')
+    input_list.append(f'REVERSE {job_spec["reverse"]}')
+    return Job(job_id, input_list)
+
+def run_job(job: Job, caches: dict = None) -> list[str]:
+    '''returns the output lines of one job. Bad input lines fail just that
+    job instead of stopping the whole batch'''
+    if job.error is not None:
+        return ['FAILED', 'INPUT', job.error]
+    try:
+        return user_interface.get_output_lines(job.input_list, caches)
+    except (IndexError, KeyError, ValueError) as e:
+        return ['FAILED', 'INPUT', f'{type(e).__name__}: {e}']
+
+def run_jobs(jobs, caches: dict = None) -> 'generator':
+    '''yields (job id, output lines) for each job as soon as it is done'''
+    for job in jobs:
+        yield (job.job_id, run_job(job, caches))
+
+async def run_jobs_concurrently(jobs, write_result, concurrency: int,
+                                caches: dict = None) -> None:
+    '''runs up to concurrency jobs at once through async_pipeline and calls
+    write_result(job id, output lines) for each one in input order, as soon
+    as it and every job before it are done'''
+    if caches is None:
+        caches = {}
+    session = async_pipeline.AsyncSession(
+        response_cache=caches.get('responses'))
+    pending = collections.deque()
+
+    async def run_async_job(job: Job) -> list[str]:
+        if job.error is not None:
+            return ['FAILED', 'INPUT', job.error]
+        return await async_pipeline.run_target(job.input_list, session,
+                                               caches)
+
+    for job in jobs:
+        pending.append((job.job_id, asyncio.create_task(run_async_job(job))))
+        if len(pending) >= concurrency:
+            job_id, task = pending.popleft()
+            write_result(job_id, await task)
+
+    while pending:
+        job_id, task = pending.popleft()
+        write_result(job_id, await task)
+
+def make_result_writer(output, output_format: str) -> 'function':
+    '''returns a function that writes one job's result to output, either as
+    the printed lines followed by a blank line or as one json line'''
+    def write_result(job_id, output_lines: list[str]) -> None:
+        if output_format == 'json':
+            output.write(json.dumps({'id': job_id, 'output': output_lines}))
+            output.write('\n')
+        else:
+            for line in output_lines:
+                output.write(f'{line}\n')
+            output.write('\n')
+        output.flush()
+    return write_result
+
+def run_batch(lines, output, output_format: str = 'text',
+              concurrency: int = 1, caches: dict = None) -> None:
+    '''reads jobs from lines and writes each result to output as it finishes'''
+    write_result = make_result_writer(output, output_format)
+    jobs = read_jobs(lines)
+    if concurrency > 1:
+        asyncio.run(run_jobs_concurrently(jobs, write_result, concurrency,
+                                          caches))
+    else:
+        for job_id, output_lines in run_jobs(jobs, caches):
+            write_result(job_id, output_lines)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='runs many weather jobs from a file or stdin')
+    parser.add_argument('input_file', nargs='?',
+        help='file of job blocks or json lines, stdin if left out')
+    parser.add_argument('--format', choices=['text', 'json'], default=None,
+        help='output format, json by default when the input is a .jsonl file')
+    parser.add_argument('--concurrency', type=int, default=1,
+        help='number of jobs to run at once')
+    args = parser.parse_args()
+
+    output_format = args.format
+    if output_format is None:
+        is_jsonl = args.input_file is not None and (
+            args.input_file.endswith('.jsonl'))
+        output_format = 'json' if is_jsonl else 'text'
+
+    export_format = instrumentation.configure_from_environment()
+    caches = user_interface.open_caches()
+    if args.input_file is None:
+        run_batch(sys.stdin, sys.stdout, output_format, args.concurrency,
+                  caches)
+    else:
+        with open(args.input_file, 'r') as file:
+            run_batch(file, sys.stdout, output_format, args.concurrency,
+                      caches)
+
+    if export_format is not None:
+        instrumentation.export(export_format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import json
+import json_decoding
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+import user_interface
+import weather_forecast
+import weather_utils
+
+#forecast sizes to time: a day, what the nws gives (6.5 days) and more
+FORECAST_SIZES = (24, 156, 1000)
+QUERY_TYPES = ('TEMPERATURE AIR F', 'TEMPERATURE AIR C',
+               'TEMPERATURE FEELS F', 'TEMPERATURE FEELS C', 'HUMIDITY',
+               'WIND', 'PRECIPITATION')
+FIRST_START_TIME = datetime.datetime(2024, 11, 7, 15,
+    tzinfo=datetime.timezone(datetime.timedelta(hours=-8)))
+
+#a benchmark counts as slower or faster than the one it is compared to if
+#it changed by more than this share
+DEFAULT_THRESHOLD = 0.10
+
+
+def make_forecast(num_of_periods: int, seed: int = 0) -> dict:
+    '''makes a forecastHourly document shaped like the nws one, with
+    num_of_periods hourly periods of made up weather. The same seed always
+    makes the same forecast'''
+    generator = random.Random(seed)
+    periods = []
+    for period_num in range(num_of_periods):
+        start_time = FIRST_START_TIME + datetime.timedelta(hours=period_num)
+        periods.append({
+            'number': period_num + 1,
+            'startTime': start_time.isoformat(),
+            'endTime': (start_time + datetime.timedelta(hours=1)).isoformat(),
+            'isDaytime': 6 <= start_time.hour < 18,
+            'temperature': generator.randint(20, 100),
+            'temperatureUnit': 'F',
+            'probabilityOfPrecipitation': {'unitCode': 'wmoUnit:percent',
+                                           'value': generator.randint(0, 100)},
+            'relativeHumidity': {'unitCode': 'wmoUnit:percent',
+                                 'value': generator.randint(5, 100)},
+            'windSpeed': f'{generator.randint(0, 30)} mph',
+            'windDirection': generator.choice(['N', 'E', 'S', 'W']),
+            'shortForecast': 'Sunny'})
+
+    return {'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [[
+                [-117.8453, 33.6543], [-117.8398, 33.6769],
+                [-117.8669, 33.6815], [-117.8724, 33.6589],
+                [-117.8453, 33.6543]]]},
+            'properties': {
+                'updateTime': FIRST_START_TIME.isoformat(),
+                'validTimes': f'{FIRST_START_TIME.isoformat()}/P7DT9H',
+                'periods': periods}}
+
+def make_queries(num_of_periods: int, num_of_queries: int,
+                 seed: int = 0) -> list[str]:
+    '''makes num_of_queries queries of every type, looking at up to
+    num_of_periods periods'''
+    generator = random.Random(seed)
+    return [f'{generator.choice(QUERY_TYPES)} '
+            f'{generator.randint(1, num_of_periods)} '
+            f'{generator.choice(["MAX", "MIN"])}'
+            for query_num in range(num_of_queries)]
+
+def make_range_queries(num_of_periods: int, num_of_queries: int,
+                       seed: int = 0) -> list[str]:
+    '''makes num_of_queries START:END queries of every type, all inside
+    num_of_periods periods'''
+    generator = random.Random(seed)
+    queries = []
+    for query_num in range(num_of_queries):
+        start = generator.randrange(num_of_periods)
+        end = generator.randint(start + 1, num_of_periods)
+        queries.append(f'{generator.choice(QUERY_TYPES)} {start}:{end} '
+                       f'{generator.choice(["MAX", "MIN"])}')
+    return queries
+
+def write_fixtures(directory: str, sizes: tuple = FORECAST_SIZES) -> dict:
+    '''writes a forecast file for each size and the two nominatim files
+    into directory. Returns the forecast file name for each size'''
+    with open(os.path.join(directory, 'nominatim_target.json'), 'w') as file:
+        json.dump([{'lat': '33.6432477', 'lon': '-117.8419202',
+                    'display_name': 'Bren Hall, Irvine, California'}], file)
+    with open(os.path.join(directory, 'nominatim_reverse.json'), 'w') as file:
+        json.dump({'display_name': 'Irvine, Orange County, California'}, file)
+
+    forecast_files = {}
+    for size in sizes:
+        forecast_files[size] = os.path.join(directory, f'nws_{size}.json')
+        with open(forecast_files[size], 'w') as file:
+            json.dump(make_forecast(size, seed=size), file)
+    return forecast_files
+
+def time_call(function, repeat: int = 5, min_time: float = 0.2) -> dict:
+    '''times function like timeit does: enough calls to take about min_time
+    seconds, repeat times. The best time per call is the one to compare,
+    since slower runs were only slowed down by something else'''
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    times = [time / number for time in timer.repeat(repeat, number)]
+    return {'best': min(times), 'median': statistics.median(times),
+            'number': number, 'repeat': repeat}
+
+def get_benchmarks(directory: str, sizes: tuple = FORECAST_SIZES,
+                   num_of_queries: int = 200) -> dict:
+    '''returns a function to time for each benchmark, all using fixtures
+    written to directory'''
+    forecast_files = write_fixtures(directory, sizes)
+    target_file = os.path.join(directory, 'nominatim_target.json')
+    reverse_file = os.path.join(directory, 'nominatim_reverse.json')
+    benchmarks = {}
+
+    for size in sizes:
+        forecast_file = forecast_files[size]
+        with open(forecast_file, 'rb') as file:
+            forecast_bytes = file.read()
+        forecast = json_decoding.loads(forecast_bytes)
+        weather_finder = weather_forecast.WeatherForecastWithFile(
+            forecast_file)
+        weather_table = weather_finder.get_forecast_table()
+        queries = make_queries(size, num_of_queries, seed=size)
+        range_queries = make_range_queries(size, num_of_queries, seed=size)
+        input_list = ([f'TARGET FILE {target_file}',
+                       f'WEATHER FILE {forecast_file}'] + queries
+                      + ['NO MORE QUERIES', f'REVERSE FILE {reverse_file}'])
+        temps = list(weather_table.temperatures)
+        humidities = list(weather_table.humidities)
+        winds = list(weather_table.winds)
+
+        def make_output_list(input_list=input_list):
+            objects = user_interface.create_objects_and_attributions(
+                input_list)
+            return user_interface.make_output_list(input_list, objects)
+
+        benchmarks.update({
+            f'decode_json/{size}': lambda forecast_bytes=forecast_bytes:
+                json_decoding.loads(forecast_bytes),
+            f'get_weather_list/{size}': lambda forecast=forecast, size=size:
+                weather_forecast._get_weather_list(forecast, size),
+            f'get_forecast_table/{size}': lambda forecast=forecast:
+                weather_forecast._get_forecast_table(forecast),
+            f'process_query/{size}': lambda weather_finder=weather_finder,
+                query=f'TEMPERATURE FEELS C {size} MAX':
+                weather_utils.process_query(query, weather_finder),
+            f'process_queries/{size}x{num_of_queries}':
+                lambda weather_finder=weather_finder, queries=queries:
+                weather_utils.process_queries(queries, weather_finder),
+            f'process_range_queries/{size}x{num_of_queries}':
+                lambda weather_finder=weather_finder,
+                queries=range_queries:
+                weather_utils.process_queries(queries, weather_finder),
+            f'format_date_time/{size}': lambda weather_table=weather_table:
+                [weather_utils.format_date_time((start_time, 0))
+                 for start_time in weather_table.start_times],
+            f'get_utc_times/{size}': lambda weather_table=weather_table:
+                weather_table.get_utc_times(),
+            f'feels_like_scalar/{size}': lambda temps=temps,
+                humidities=humidities, winds=winds:
+                list(map(weather_utils.feels_like_temperature, temps,
+                         humidities, winds)),
+            f'feels_like_array/{size}': lambda temps=temps,
+                humidities=humidities, winds=winds:
+                weather_utils.feels_like_temperature_array(temps, humidities,
+                                                           winds),
+            f'make_output_list/{size}x{num_of_queries}': make_output_list})
+
+    return benchmarks
+
+def run_benchmarks(sizes: tuple = FORECAST_SIZES, num_of_queries: int = 200,
+                   repeat: int = 5, min_time: float = 0.2,
+                   name_filter: str = None) -> dict:
+    '''times every benchmark whose name contains name_filter and returns
+    the results along with what they were run on'''
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = get_benchmarks(directory, sizes, num_of_queries)
+        for name, function in benchmarks.items():
+            if name_filter is None or name_filter in name:
+                results[name] = time_call(function, repeat, min_time)
+
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'json_backend': json_decoding.BACKEND,
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'benchmarks': results}
+
+def compare_results(old_results: dict, new_results: dict,
+                    threshold: float = DEFAULT_THRESHOLD) -> list[tuple]:
+    '''returns (name, old best, new best, new / old, verdict) for every
+    benchmark in both results. verdict is 'slower', 'faster' or 'same'
+    depending on whether the time changed by more than threshold'''
+    comparison = []
+    old_benchmarks = old_results['benchmarks']
+    for name, new_timing in new_results['benchmarks'].items():
+        if name not in old_benchmarks:
+            continue
+        old_best = old_benchmarks[name]['best']
+        new_best = new_timing['best']
+        ratio = new_best / old_best
+        if ratio > 1 + threshold:
+            verdict = 'slower'
+        elif ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        comparison.append((name, old_best, new_best, ratio, verdict))
+    return comparison
+
+def print_results(results: dict) -> None:
+    for name, timing in results['benchmarks'].items():
+        print(f'{name:40} {timing["best"] * 1e6:12.2f} us')
+
+def print_comparison(comparison: list[tuple]) -> None:
+    for name, old_best, new_best, ratio, verdict in comparison:
+        print(f'{name:40} {old_best * 1e6:12.2f} us {new_best * 1e6:12.2f} us'
+              f' {ratio:6.2f}x {verdict}')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='times parsing, queries and whole runs on made up '
+                    'forecasts')
+    parser.add_argument('--output',
+        help='json file to save the results to')
+    parser.add_argument('--compare',
+        help='json results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='change that counts as slower or faster, 0.10 by default')
+    parser.add_argument('--sizes', type=int, nargs='+',
+        default=list(FORECAST_SIZES),
+        help='forecast sizes in periods')
+    parser.add_argument('--queries', type=int, default=200,
+        help='number of queries for the many query benchmarks')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='number of timings of each benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2,
+        help='seconds each timing should take at least')
+    parser.add_argument('--filter',
+        help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    results = run_benchmarks(tuple(args.sizes), args.queries, args.repeat,
+                             args.min_time, args.filter)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare is None:
+        print_results(results)
+        return
+
+    with open(args.compare, 'r') as file:
+        comparison = compare_results(json.load(file), results,
+                                     args.threshold)
+    print_comparison(comparison)
+    if any(verdict == 'slower' for *timing, verdict in comparison):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,69 @@
-import json
+import http.client
+import http_cache
+import http_pool
+import http_retry
+import instrumentation
+import json_decoding
 import program_errors
 import urllib.request
 
 
-def send_request(request: urllib.request) -> tuple:
+def send_request(request: urllib.request, pool: http_pool.ConnectionPool = None,
+                 response_cache: http_cache.ResponseCache = None,
+                 retry_policy: http_retry.RetryPolicy = None) -> tuple:
     '''sends a request to the server and montitors any errors that might occur.
     If the server can't connect or the status code is not 200 or if the
-    data can't be interpreted as json, the custom api exception is raised'''
-    ENCODING = 'utf-8'
+    data can't be interpreted as json, the custom api exception is raised.
+    The request goes through a connection pool (http_pool.DEFAULT_POOL unless
+    another is given) so connections to the same host are kept alive. If a
+    response cache is given, a fresh cached response is returned without
+    contacting the server and a stale one is revalidated. Network errors
+    and temporary server errors are retried as retry_policy says
+    (http_retry.DEFAULT_RETRY_POLICY unless another is given), and a host
+    whose circuit breaker is open fails as a network error right away'''
+    if pool is None:
+        pool = http_pool.DEFAULT_POOL
+    if retry_policy is None:
+        retry_policy = http_retry.DEFAULT_RETRY_POLICY
+
+    headers = dict(request.header_items())
+    cached = None
+    if response_cache is not None:
+        cached = response_cache.lookup(request.full_url)
+        if cached is not None and cached.is_fresh():
+            instrumentation.count('http_cache.fresh_hits')
+            return (cached.json_data, request.full_url)
+        headers.update(response_cache.get_conditional_headers(cached))
     
     try:
-        response = urllib.request.urlopen(request)
-    except urllib.error.HTTPError as e:
-        error_url = e.url
-        status_code = e.code
-        raise program_errors.ApiFailureError(e.url, 'not 200', e.code)
-    except urllib.error.URLError:
+        response = retry_policy.send(pool, request.full_url, headers)
+    except http_pool.ContentDecodingError as e:
+        raise program_errors.ApiFailureError(e.url, 'format', e.status)
+    except (OSError, http.client.HTTPException):
+        instrumentation.count('http.network_errors')
         raise program_errors.ApiFailureError(request.full_url, 'network')
-        
 
-    status_code = response.getcode()
+    status_code = response.status
+    if status_code == 304 and cached is not None:
+        instrumentation.count('http_cache.not_modified')
+        response_cache.update_response(request.full_url, cached,
+                                       response.headers)
+        return (cached.json_data, request.full_url)
+
     if status_code != 200:
-        raise ApiFailureError(request.full_url, 'not 200', status_code)
-        
-    data = response.read()
-    response.close()
-    try:
-        text = data.decode(encoding = ENCODING)
-    except UnicodeDecodeError:
-        raise program_errors.ApiFailureError(request.full_url, 'format',
+        raise program_errors.ApiFailureError(response.url, 'not 200',
                                              status_code)
-    
+        
+    #decoded straight from the bytes instead of making a str copy first
     try:
-        json_data = json.loads(text)
-    except json.JSONDecodeError:
+        json_data = json_decoding.loads(response.body)
+    except ValueError:
         raise program_errors.ApiFailureError(request.full_url, 'format',
                                              status_code)
+
+    if response_cache is not None:
+        response_cache.store_response(request.full_url, json_data,
+                                      response.headers)
         
     return (json_data, request.full_url)
 
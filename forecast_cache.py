@@ -0,0 +1,230 @@
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import re
+import sys
+import threading
+import time
+
+#the nws makes a new hourly forecast about once an hour
+FORECAST_UPDATE_INTERVAL = 60 * 60
+
+#a forecast is always kept at least this long, even if its updateTime says
+#a newer one should already be out, so a late update doesn't mean fetching
+#on every request
+MIN_FORECAST_TTL = 5 * 60
+
+_DURATION = re.compile(
+    r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+
+class CachedForecast:
+    '''the parts of one forecast the program reads, built once from the json
+    and shared by every forecast object for the same grid'''
+    __slots__ = ('forecast_table', 'coordinates', 'polygon', 'expires',
+                 'size')
+
+    def __init__(self, forecast_table, coordinates, polygon: list,
+                 expires: float):
+        self.forecast_table = forecast_table
+        self.coordinates = coordinates
+        self.polygon = polygon
+        self.expires = expires
+        self.size = _estimate_size(forecast_table, coordinates, polygon)
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires
+
+
+class ForecastCache:
+    '''in-memory cache of forecasts keyed by the nws gridpoint url, for a
+    process that looks up many targets. Each forecast is kept until
+    get_forecast_expiry says a newer one should be out. Once there are more
+    than max_entries forecasts, or they take up more than about max_bytes,
+    the least recently used ones are dropped. If several threads ask for the
+    same grid while it isn't cached, only one of them fetches it and the
+    others wait for its result (or its error)'''
+    def __init__(self, max_entries: int = 256, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self._size = 0
+        self._entries = collections.OrderedDict()
+        self._fetches = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, fetch) -> CachedForecast:
+        '''returns the cached forecast for url, calling fetch(url) to make a
+        new CachedForecast if there isn't a fresh one. Errors from fetch are
+        raised in every thread that was waiting for it and aren't cached'''
+        cached, running_fetch, is_new_fetch = self._find(url)
+        if cached is not None:
+            return cached
+        if not is_new_fetch:
+            return running_fetch.result()
+
+        try:
+            forecast = fetch(url)
+        except BaseException as e:
+            self._end_fetch(url, running_fetch, error=e)
+            raise
+        self._end_fetch(url, running_fetch, forecast)
+        return forecast
+
+    async def get_async(self, url: str, fetch) -> CachedForecast:
+        '''get for asyncio code, where fetch is an async function. A task
+        waiting for a fetch that another task or thread is running doesn't
+        block the event loop'''
+        cached, running_fetch, is_new_fetch = self._find(url)
+        if cached is not None:
+            return cached
+        if not is_new_fetch:
+            return await asyncio.wrap_future(running_fetch)
+
+        try:
+            forecast = await fetch(url)
+        except BaseException as e:
+            self._end_fetch(url, running_fetch, error=e)
+            raise
+        self._end_fetch(url, running_fetch, forecast)
+        return forecast
+
+    def _find(self, url: str) -> tuple:
+        '''returns (the fresh cached forecast or None, the future of the fetch
+        for url, whether the caller has to run that fetch itself)'''
+        with self._lock:
+            cached = self._entries.get(url)
+            if cached is not None:
+                if cached.is_fresh():
+                    self._entries.move_to_end(url)
+                    self.hits += 1
+                    return (cached, None, False)
+                self._forget(url)
+
+            running_fetch = self._fetches.get(url)
+            if running_fetch is not None:
+                self.shared += 1
+                return (None, running_fetch, False)
+
+            self.misses += 1
+            running_fetch = concurrent.futures.Future()
+            self._fetches[url] = running_fetch
+            return (None, running_fetch, True)
+
+    def _end_fetch(self, url: str, running_fetch, forecast=None,
+                   error: BaseException = None) -> None:
+        '''hands the result of a fetch to everything waiting for it. Only a
+        forecast that fetch returned is cached, anything it raised (even
+        KeyboardInterrupt) is handed to the waiters instead'''
+        with self._lock:
+            del self._fetches[url]
+            if error is None:
+                self._remember(url, forecast)
+        if error is None:
+            running_fetch.set_result(forecast)
+        else:
+            running_fetch.set_exception(error)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses,
+                'shared': self.shared, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self._size}
+
+    def _remember(self, url: str, forecast: CachedForecast) -> None:
+        '''adds forecast and evicts the least recently used forecasts until
+        the cache is within its limits. Must be called holding the lock'''
+        if url in self._entries:
+            self._forget(url)
+        self._entries[url] = forecast
+        self._size += forecast.size
+
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None
+                    and self._size > self.max_bytes)):
+            self._forget(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _forget(self, url: str) -> None:
+        self._size -= self._entries.pop(url).size
+
+
+def get_forecast_expiry(json_data: dict, now: float = None) -> float:
+    '''returns when a forecast should be fetched again as seconds since the
+    epoch: an update interval after its updateTime, but no later than the
+    end of its validTimes, and at least MIN_FORECAST_TTL from now. A forecast
+    without a readable updateTime is kept for MIN_FORECAST_TTL'''
+    if now is None:
+        now = time.time()
+    try:
+        properties = json_data['properties']
+    except (KeyError, TypeError):
+        return now + MIN_FORECAST_TTL
+
+    expires = _parse_time(properties.get('updateTime'))
+    if expires is None:
+        return now + MIN_FORECAST_TTL
+    expires += FORECAST_UPDATE_INTERVAL
+
+    valid_until = _get_end_of_interval(properties.get('validTimes'))
+    if valid_until is not None:
+        expires = min(expires, valid_until)
+
+    return max(expires, now + MIN_FORECAST_TTL)
+
+def _get_end_of_interval(interval: str) -> float:
+    '''returns the end of an iso 8601 interval like
+    2024-11-07T17:00:00+00:00/P7DT8H, or None if it can't be read'''
+    if not isinstance(interval, str):
+        return None
+    start, _, duration = interval.partition('/')
+    start = _parse_time(start)
+    match = _DURATION.match(duration)
+    if start is None or match is None:
+        return None
+
+    days, hours, minutes, seconds = (int(part) if part is not None else 0
+                                     for part in match.groups())
+    return start + ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def _parse_time(time_string: str) -> float:
+    '''turns an iso time into seconds since the epoch, or None if it can't'''
+    if not isinstance(time_string, str):
+        return None
+    try:
+        return datetime.datetime.fromisoformat(time_string).timestamp()
+    except ValueError:
+        return None
+
+def _estimate_size(forecast_table, coordinates, polygon: list) -> int:
+    '''roughly how many bytes a cached forecast takes up, counting its arrays,
+    strings and polygon but not the small objects around them'''
+    size = sys.getsizeof(forecast_table.timestamps)
+    size += sum(sys.getsizeof(column)
+                for column in forecast_table.columns.values())
+    size += sys.getsizeof(forecast_table.start_times)
+    size += sum(sys.getsizeof(start_time)
+                for start_time in forecast_table.start_times)
+    size += sys.getsizeof(coordinates)
+    size += _estimate_list_size(polygon)
+    return size
+
+def _estimate_list_size(value) -> int:
+    '''bytes taken up by nested lists from json, like a polygon's rings of
+    [longitude, latitude] pairs, and everything in them'''
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(_estimate_list_size(item)
+                                          for item in value)
+    return sys.getsizeof(value)
@@ -0,0 +1,205 @@
+import codecs
+import json
+import mmap
+import re
+
+#the only parts of a forecastHourly document the program reads
+PERIOD_KEYS = ('startTime', 'temperature', 'relativeHumidity', 'windSpeed',
+               'probabilityOfPrecipitation')
+PROPERTY_KEYS = ('updateTime', 'validTimes')
+
+#bytes are decoded to text this much at a time at first, then as much again
+#as has been decoded so far, so the text is copied a few times at most
+CHUNK_SIZE = 64 * 1024
+
+#a number cut off at the end of the decoded text can decode as a shorter
+#number with up to this many characters of it left over, like "-12." or
+#"1.5e+"
+_NUMBER_TAIL = 2
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+
+
+class _Done(Exception):
+    '''raised to stop scanning once everything needed has been found'''
+
+
+class _ForecastScanner:
+    '''walks a forecast document one value at a time instead of turning the
+    whole thing into python objects at once. Each value is decoded on its own
+    with json's raw_decode and thrown away right away unless it is needed,
+    and periods are trimmed down to PERIOD_KEYS as they are read, so the
+    full document never exists as python objects. Bytes are decoded to text
+    in chunks as the scan reaches them when max_periods is given, so a scan
+    that stops early doesn't decode the rest of the document'''
+    def __init__(self, data, max_periods: int = None):
+        self.max_periods = max_periods
+        self.forecast = {}
+        if max_periods is None and not isinstance(data, str):
+            #all of it is going to be read anyway
+            data = str(data, 'utf-8')
+
+        if isinstance(data, str):
+            self.text = data
+            self._data = None
+        else:
+            self.text = ''
+            self._data = data
+            self._decoder = codecs.getincrementaldecoder('utf-8')()
+            self._data_pos = 0
+
+    def scan(self) -> dict:
+        try:
+            pos = self._skip_whitespace(0)
+            self._expect(pos, '{')
+            pos = self._scan_object(pos, self._handle_top_level)
+            if self._char(self._skip_whitespace(pos)) != '':
+                raise ValueError('extra data after the forecast')
+        except _Done:
+            pass
+        return self.forecast
+
+    def _handle_top_level(self, key: str, pos: int) -> int:
+        if key == 'properties' and self._char(pos) == '{':
+            self.forecast['properties'] = {}
+            return self._scan_object(pos, self._handle_property)
+
+        value, end = self._decode_value(pos)
+        if key == 'geometry':
+            self.forecast['geometry'] = value
+        return end
+
+    def _handle_property(self, key: str, pos: int) -> int:
+        properties = self.forecast['properties']
+        if key == 'periods' and self._char(pos) == '[':
+            properties['periods'] = []
+            return self._scan_periods(pos)
+
+        value, end = self._decode_value(pos)
+        if key in PROPERTY_KEYS:
+            properties[key] = value
+        return end
+
+    def _scan_periods(self, pos: int) -> int:
+        '''reads periods one at a time, keeping only PERIOD_KEYS of each, and
+        stops once max_periods have been read'''
+        periods = self.forecast['properties']['periods']
+        pos = self._skip_whitespace(pos + 1)
+        if self._char(pos) == ']':
+            return pos + 1
+
+        while True:
+            keep_period = (self.max_periods is None
+                           or len(periods) < self.max_periods)
+            if not keep_period and 'geometry' in self.forecast:
+                raise _Done()
+
+            #past max_periods the periods are still read to get to the
+            #polygon, but not kept
+            period, end = self._decode_value(pos)
+            if keep_period:
+                if isinstance(period, dict):
+                    period = {key: period[key] for key in PERIOD_KEYS
+                              if key in period}
+                periods.append(period)
+
+            pos = self._skip_whitespace(end)
+            separator = self._char(pos)
+            if separator == ']':
+                return pos + 1
+            elif separator != ',':
+                raise ValueError(f'expected , or ] at {pos}')
+            pos = self._skip_whitespace(pos + 1)
+
+    def _scan_object(self, pos: int, handle_member) -> int:
+        '''calls handle_member(key, value position) for each member of the
+        object starting at pos. handle_member returns where the value ends.
+        Returns where the object ends'''
+        pos = self._skip_whitespace(pos + 1)
+        if self._char(pos) == '}':
+            return pos + 1
+
+        while True:
+            self._expect(pos, '"')
+            key, pos = self._decode_value(pos)
+            pos = self._skip_whitespace(pos)
+            self._expect(pos, ':')
+            pos = self._skip_whitespace(pos + 1)
+
+            pos = self._skip_whitespace(handle_member(key, pos))
+            separator = self._char(pos)
+            if separator == '}':
+                return pos + 1
+            elif separator != ',':
+                raise ValueError(f'expected , or }} at {pos}')
+            pos = self._skip_whitespace(pos + 1)
+
+    def _decode_value(self, pos: int) -> tuple:
+        '''raw_decodes the value at pos, decoding more of the document first
+        if the value runs past the text decoded so far. A value ending within
+        _NUMBER_TAIL characters of the end of the text could be a cut off
+        number, so it is decoded again with more text too'''
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, pos)
+            except json.JSONDecodeError:
+                if not self._decode_more():
+                    raise
+                continue
+            if (len(self.text) - end > _NUMBER_TAIL
+                    or not self._decode_more()):
+                return (value, end)
+
+    def _char(self, pos: int) -> str:
+        '''the character at pos, or '' past the end of the document'''
+        while pos >= len(self.text) and self._decode_more():
+            pass
+        return self.text[pos:pos + 1]
+
+    def _skip_whitespace(self, pos: int) -> int:
+        while True:
+            end = _WHITESPACE.match(self.text, pos).end()
+            if end < len(self.text) or not self._decode_more():
+                return end
+            pos = end
+
+    def _decode_more(self) -> bool:
+        '''adds the next chunk of the document to the text. Returns False
+        if there is no more'''
+        if self._data is None or self._data_pos >= len(self._data):
+            return False
+        chunk_size = max(CHUNK_SIZE, len(self.text))
+        chunk = self._data[self._data_pos:self._data_pos + chunk_size]
+        self._data_pos += len(chunk)
+        is_last_chunk = self._data_pos >= len(self._data)
+        self.text += self._decoder.decode(chunk, final=is_last_chunk)
+        return True
+
+    def _expect(self, pos: int, character: str) -> None:
+        if self._char(pos) != character:
+            raise ValueError(f'expected {character} at {pos}')
+
+
+def extract_forecast(data, max_periods: int = None) -> dict:
+    '''pulls just the polygon, updateTime, validTimes and the fields of each
+    period the program uses out of a forecastHourly document (str, bytes or a
+    memory-mapped file), stopping after max_periods periods if it is given.
+    The result has the same shape as the full document, so everything that
+    reads the full document can read it. With max_periods, bytes are only
+    decoded as far as the scan gets. Raises ValueError if the document isn't
+    valid utf-8 json'''
+    return _ForecastScanner(data, max_periods).scan()
+
+def load_forecast_file(file_name: str, max_periods: int = None) -> dict:
+    '''memory-maps a saved forecast file and runs extract_forecast on it.
+    Raises OSError if the file can't be opened'''
+    with open(file_name, 'rb') as file:
+        try:
+            mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            #empty files can't be mapped
+            return extract_forecast(file.read(), max_periods)
+
+        with mapped_file:
+            return extract_forecast(mapped_file, max_periods)
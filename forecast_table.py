@@ -0,0 +1,155 @@
+import array
+import bisect
+import datetime
+import functools
+
+MISSING = float('nan')
+
+#same order as the values of a Period
+WEATHER_COLUMNS = ('TEMPERATURE', 'HUMIDITY', 'WIND', 'PRECIPITATION')
+
+#the Period attribute that holds each weather type
+WEATHER_ATTRIBUTES = {'TEMPERATURE': 'temperature', 'HUMIDITY': 'humidity',
+                      'WIND': 'wind', 'PRECIPITATION': 'precipitation'}
+
+
+class Period:
+    '''one hourly period of a forecast. Values are read by name, or by index
+    in the old [time, temp, humidity, wind, precipitation] order. Missing
+    values are None'''
+    __slots__ = ('start_time', 'temperature', 'humidity', 'wind',
+                 'precipitation')
+
+    def __init__(self, start_time: str, temperature: float, humidity: float,
+                 wind: float, precipitation: float):
+        self.start_time = start_time
+        self.temperature = temperature
+        self.humidity = humidity
+        self.wind = wind
+        self.precipitation = precipitation
+
+    def __getitem__(self, index: int):
+        return getattr(self, self.__slots__[index])
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __repr__(self) -> str:
+        return (f'Period({self.start_time!r}, {self.temperature!r}, '
+                f'{self.humidity!r}, {self.wind!r}, {self.precipitation!r})')
+
+    def get_value(self, weather_type: str) -> float:
+        '''returns the value of a weather type, like WIND'''
+        return getattr(self, WEATHER_ATTRIBUTES[weather_type])
+
+
+class ForecastTable:
+    '''column oriented copy of the hourly forecast periods. Every weather value
+    is kept in its own array of floats so the json only has to be walked once,
+    and a query just looks at a prefix of the table. Missing values are stored
+    as nan'''
+    def __init__(self, start_times: list, timestamps: array.array,
+                 columns: dict, length: int = None):
+        self.start_times = start_times
+        self.timestamps = timestamps
+        self.columns = columns
+        if length is None:
+            length = len(timestamps)
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, period_num: int) -> Period:
+        '''makes a Period for one row of the table'''
+        if not 0 <= period_num < self.length:
+            raise IndexError('period number out of range')
+        values = [self.columns[weather_type][period_num]
+                  for weather_type in WEATHER_COLUMNS]
+        return Period(self.start_times[period_num],
+                      *(None if value != value else value
+                        for value in values))
+
+    def __iter__(self):
+        for period_num in range(self.length):
+            yield self[period_num]
+
+    @property
+    def temperatures(self) -> memoryview:
+        return self.column('TEMPERATURE')
+
+    @property
+    def humidities(self) -> memoryview:
+        return self.column('HUMIDITY')
+
+    @property
+    def winds(self) -> memoryview:
+        return self.column('WIND')
+
+    @property
+    def precipitations(self) -> memoryview:
+        return self.column('PRECIPITATION')
+
+    def prefix(self, length: int) -> 'ForecastTable':
+        '''returns a table of the first length periods. The arrays are shared
+        with this table so nothing is copied'''
+        length = max(0, min(length, self.length))
+        return ForecastTable(self.start_times, self.timestamps, self.columns,
+                             length)
+
+    def find_period(self, timestamp: int) -> int:
+        '''returns the number of the period that timestamp (seconds since the
+        epoch) falls in, or -1 if it is before the first period. Periods are
+        in time order, so this is a binary search of the timestamps'''
+        return bisect.bisect_right(self.timestamps, timestamp, 0,
+                                   self.length) - 1
+
+    def until(self, timestamp: int) -> 'ForecastTable':
+        '''returns a table of the periods that start before timestamp'''
+        return self.prefix(bisect.bisect_left(self.timestamps, timestamp, 0,
+                                              self.length))
+
+    def get_utc_time(self, period_num: int) -> str:
+        '''returns the start of a period as a utc time like
+        2024-11-07T23:00:00Z'''
+        return format_utc_time(self.timestamps[period_num])
+
+    def get_utc_times(self) -> list[str]:
+        '''returns the utc start time of every period in this table'''
+        return [format_utc_time(timestamp)
+                for timestamp in self.timestamps[:self.length]]
+
+    def column(self, weather_type: str) -> memoryview:
+        '''returns the values of one weather type (TEMPERATURE, HUMIDITY, WIND
+        or PRECIPITATION) for the periods in this table'''
+        return memoryview(self.columns[weather_type])[:self.length]
+
+    def get_weather_list(self) -> list:
+        '''returns a Period for every row, which can still be read like the
+        [time, temp, humidity, wind, precipitation] lists used before the
+        table existed'''
+        return list(self)
+
+
+def make_empty_columns() -> dict:
+    '''makes one empty array for each weather type'''
+    return {weather_type: array.array('d') for weather_type in WEATHER_COLUMNS}
+
+
+#forecasts from the same area start on the same hours, so the same few
+#hundred times get formatted over and over
+@functools.lru_cache(maxsize=4096)
+def format_utc_time(timestamp: int) -> str:
+    '''formats seconds since the epoch as a utc time like
+    2024-11-07T23:00:00Z'''
+    utc_date_time = datetime.datetime.fromtimestamp(timestamp,
+                                                    datetime.timezone.utc)
+    return utc_date_time.isoformat().replace('+00:00', 'Z')
+
+
+def to_float(value) -> float:
+    '''only ints and floats count as weather values, anything else (None, ''
+    or a string) is stored as missing'''
+    if type(value) == int or type(value) == float:
+        return float(value)
+    return MISSING
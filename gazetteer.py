@@ -0,0 +1,144 @@
+import array
+import collections
+import csv
+import functools
+import json_decoding
+import math
+import program_errors
+
+EARTH_RADIUS_KM = 6371.0088
+
+Place = collections.namedtuple('Place', ['name', 'lat', 'lon'])
+
+#column names a place file can use, the first one found is used
+NAME_COLUMNS = ('display_name', 'name')
+LAT_COLUMNS = ('lat', 'latitude')
+LON_COLUMNS = ('lon', 'lng', 'longitude')
+
+
+class Gazetteer:
+    '''places from a local file in a kd-tree, for finding the place nearest
+    to some coordinates without asking nominatim. Places are stored as 3d
+    points on a unit sphere, so the straight line distance the tree measures
+    orders places the same way as the distance along the earth's surface,
+    even near the poles or across the 180th meridian. The tree is kept flat:
+    the place splitting a range of positions is in the middle of the range,
+    and the depth decides whether it splits on x, y or z'''
+    def __init__(self, places: list):
+        self.places = places
+        self._points = array.array('d')
+        for place in places:
+            self._points.extend(_to_unit_vector(place.lat, place.lon))
+
+        order = list(range(len(places)))
+        self._build(order, 0, len(order), 0)
+        self._order = array.array('q', order)
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def find_nearest(self, lat: float, lon: float) -> tuple:
+        '''returns the place nearest to lat, lon and how far away it is in
+        km, or (None, None) if there are no places'''
+        if len(self.places) == 0:
+            return (None, None)
+
+        #[place number, squared distance] of the nearest place so far
+        nearest = [None, math.inf]
+        self._search(_to_unit_vector(lat, lon), 0, len(self._order), 0,
+                     nearest)
+        return (self.places[nearest[0]], _chord_to_km(nearest[1] ** 0.5))
+
+    def _build(self, order: list, low: int, high: int, axis: int) -> None:
+        '''sorts order[low:high] on axis and does the same to each half on
+        the next axis, leaving the median in the middle'''
+        if high - low <= 1:
+            return
+        points = self._points
+        order[low:high] = sorted(order[low:high],
+                                 key=lambda place_num:
+                                     points[place_num * 3 + axis])
+        middle = (low + high) // 2
+        next_axis = (axis + 1) % 3
+        self._build(order, low, middle, next_axis)
+        self._build(order, middle + 1, high, next_axis)
+
+    def _search(self, target: tuple, low: int, high: int, axis: int,
+                nearest: list) -> None:
+        '''looks for a place nearer than nearest in order[low:high], going
+        into the other half of a split only if it could hold one'''
+        if low >= high:
+            return
+        middle = (low + high) // 2
+        place_num = self._order[middle]
+        point = place_num * 3
+        points = self._points
+
+        dx = points[point] - target[0]
+        dy = points[point + 1] - target[1]
+        dz = points[point + 2] - target[2]
+        distance = dx * dx + dy * dy + dz * dz
+        if distance < nearest[1]:
+            nearest[0] = place_num
+            nearest[1] = distance
+
+        difference = target[axis] - points[point + axis]
+        next_axis = (axis + 1) % 3
+        if difference < 0:
+            self._search(target, low, middle, next_axis, nearest)
+            if difference * difference < nearest[1]:
+                self._search(target, middle + 1, high, next_axis, nearest)
+        else:
+            self._search(target, middle + 1, high, next_axis, nearest)
+            if difference * difference < nearest[1]:
+                self._search(target, low, middle, next_axis, nearest)
+
+
+#batch and service runs ask for the same file for every target
+@functools.lru_cache(maxsize=8)
+def load_gazetteer(file_name: str) -> Gazetteer:
+    '''loads the places in a file into a Gazetteer, once per process'''
+    return Gazetteer(load_places(file_name))
+
+def load_places(file_name: str) -> list[Place]:
+    '''reads places from a .csv file with a header row, or from a json file
+    holding a list of objects like nominatim's. Each place needs a name
+    (display_name or name), a latitude (lat or latitude) and a longitude
+    (lon, lng or longitude). Raises FileFailureError if the file is missing
+    or a place can't be read'''
+    try:
+        if file_name.lower().endswith('.csv'):
+            with open(file_name, 'r', newline='', encoding='utf-8') as file:
+                return [_to_place(row) for row in csv.DictReader(file)]
+        return [_to_place(row) for row in json_decoding.load_file(file_name)]
+    except OSError:
+        raise program_errors.FileFailureError(file_name, 'missing')
+    except (ValueError, KeyError, TypeError, csv.Error):
+        raise program_errors.FileFailureError(file_name, 'format')
+
+def _to_place(row: dict) -> Place:
+    '''raises KeyError if row is missing a column and ValueError if its
+    coordinates aren't numbers on the globe'''
+    name = row[_find_column(row, NAME_COLUMNS)]
+    lat = float(row[_find_column(row, LAT_COLUMNS)])
+    lon = float(row[_find_column(row, LON_COLUMNS)])
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f'{name} is not on the globe')
+    return Place(name, lat, lon)
+
+def _find_column(row: dict, columns: tuple) -> str:
+    for column in columns:
+        if column in row:
+            return column
+    raise KeyError(columns[0])
+
+def _to_unit_vector(lat: float, lon: float) -> tuple:
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon),
+            math.sin(lat))
+
+def _chord_to_km(chord: float) -> float:
+    '''turns a straight line distance between two points on the unit sphere
+    into the distance between them along the earth's surface'''
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
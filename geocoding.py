@@ -1,9 +1,25 @@
 import class_utils
+import http_retry
+import instrumentation
+import os
 import program_errors
-import json
-import time
+import json_decoding
+import persistent_cache
+import rate_limiter
 import urllib.request
 
+#nominatim allows 1 request per second, this limiter is shared by every
+#geocoder in this process and by other processes of the same user through
+#the lock file
+NOMINATIM_RATE_LIMITER = rate_limiter.RateLimiter(rate=1.0,
+    lock_file=os.path.join(persistent_cache.CACHE_DIRECTORY,
+                           'nominatim_rate.lock'))
+
+#retries wait at least a second, and take a rate limit token like every
+#other request to nominatim
+NOMINATIM_RETRY_POLICY = http_retry.RetryPolicy(min_delay=1.0,
+    rate_limiter=NOMINATIM_RATE_LIMITER)
+
 
 class ForwardGeocodingWithFile:
     '''class to get the coordinates of a location description using a flie'''
@@ -12,15 +28,13 @@ class ForwardGeocodingWithFile:
         self.json_data = self.get_json_data()
         
     def get_json_data(self) -> dict:
-        '''attempts to convert the file data into a dict using json.loads,
+        '''attempts to convert the file data into a dict using json_decoding,
         raises exceptions if it fails'''
         try:
-            with open(self.file_name, 'r') as file:
-                json_data = json.loads(file.read())
-                return json_data
+            return json_decoding.load_file(self.file_name)
         except OSError:
             raise program_errors.FileFailureError(self.file_name, 'missing')
-        except json.decoder.JSONDecodeError:
+        except ValueError:
             raise program_errors.FileFailureError(self.file_name, 'format')
         
     def get_coordinates(self) -> tuple:
@@ -36,22 +50,58 @@ class ForwardGeocodingWithApi:
     BASE_API_URL = 'https://nominatim.openstreetmap.org/search'
     HEADERS = {'Referer': 'https://www.ics.uci.edu/~thornton/icsh32'
                f'/ProjectGuide/Project3/{UCINETID}'}
+    RATE_LIMITER = NOMINATIM_RATE_LIMITER
+    RETRY_POLICY = NOMINATIM_RETRY_POLICY
 
-    def __init__(self, target: str):
+    def __init__(self, target: str, cache=None, load: bool = True):
         self.target = target
-        json_data = self.get_json_data()
-        self.json_data = json_data[0]
-        self.url = json_data[1]
+        self.cache = cache
+        self.json_data = None
+        self.url = None
+        if load:
+            self.load()
+
+    def load(self) -> 'ForwardGeocodingWithApi':
+        '''gets the data from the server (or the cache), which __init__ does
+        unless load is False'''
+        with instrumentation.span('geocoding.forward'):
+            self.json_data, self.url = self.get_json_data()
+        return self
         
     def get_json_data(self) -> dict:
-        '''attemps to get json data but waits 1 second before contacting
-        server, and returns the data as a dict''' 
-        time.sleep(1)
+        '''attemps to get json data, waiting first if another request went
+        to the server less than 1 second ago, and returns the data as a dict.
+        If a cache was given and it already has this target, the server isn't
+        contacted at all'''
+        json_data = self._get_cached_json_data()
+        if json_data is not None:
+            return json_data
+
+        self.RATE_LIMITER.acquire()
         url = self._make_url(self.target)
         request = self._make_request(url)
         json_data = self._send_request(request)
+
+        self._cache_json_data(json_data)
         return json_data
 
+    def _make_cache_key(self) -> str:
+        '''targets that only differ by case or spacing share a cache entry'''
+        return 'forward:' + ' '.join(self.target.lower().split())
+
+    def _get_cached_json_data(self) -> tuple:
+        '''returns the cached (json data, url) or None if there isn't one'''
+        if self.cache is None:
+            return None
+        json_data = self.cache.get(self._make_cache_key())
+        if json_data is None:
+            return None
+        return tuple(json_data)
+
+    def _cache_json_data(self, json_data: tuple) -> None:
+        if self.cache is not None:
+            self.cache.set(self._make_cache_key(), json_data)
+
     def _make_url(self, target: str) -> str:
         '''makaes a url to send to server based on queries'''
         encoded_params = urllib.parse.urlencode([('q', target), ('format',
@@ -64,7 +114,8 @@ class ForwardGeocodingWithApi:
                                       
     def _send_request(self, request: urllib.request.Request) -> dict:
         '''sends request'''
-        return class_utils.send_request(request)
+        return class_utils.send_request(request,
+                                        retry_policy=self.RETRY_POLICY)
         
     def get_coordinates(self) -> tuple:
         '''gets the coordinates specifying where the input location is'''
@@ -73,6 +124,32 @@ class ForwardGeocodingWithApi:
                 class_utils.access_json_data(self.json_data, [0, 'lon'],
                 url=self.url, cast=float))
 
+class ForwardGeocodingWithIndex:
+    '''forward geocoding from a local place_index.PlaceIndex instead of the
+    server. If the index has no place matching the target, the coordinates
+    come from fallback, which is a ForwardGeocodingWithApi for the same
+    target unless another geocoder is given'''
+    def __init__(self, target: str, index, cache=None, fallback=None):
+        self.target = target
+        self.index = index
+        self.place = index.find(target)
+        self.fallback = None
+        if self.place is None:
+            if fallback is None:
+                fallback = ForwardGeocodingWithApi(target, cache=cache)
+            self.fallback = fallback
+
+    def used_api(self) -> bool:
+        '''true if the coordinates had to come from the fallback'''
+        return self.fallback is not None
+
+    def get_coordinates(self) -> tuple:
+        '''gets the coordinates of the place matching the target, or the
+        fallback's coordinates if there wasn't one'''
+        if self.fallback is not None:
+            return self.fallback.get_coordinates()
+        return (self.place.lat, self.place.lon)
+
 class ReverseGeocodingWithFile:
     def __init__(self, file_name):
         self.file_name = file_name
@@ -82,12 +159,10 @@ class ReverseGeocodingWithFile:
         '''attmeps to get json data and catches any errors to raise custom
         error'''
         try:
-            with open(self.file_name, 'r') as file:
-                json_data = json.loads(file.read())
-                return json_data
+            return json_decoding.load_file(self.file_name)
         except OSError:
             raise program_errors.FileFailureError(self.file_name, 'missing')
-        except json.decoder.JSONDecodeError:
+        except ValueError:
             raise program_errors.FileFailureError(self.file_name, 'format')
 
     def get_location(self) -> str:
@@ -101,21 +176,59 @@ class ReverseGeocodingWithApi:
     BASE_API_URL = 'https://nominatim.openstreetmap.org/reverse'
     HEADERS = {'Referer': 'https://www.ics.uci.edu/~thornton/icsh32'
                f'/ProjectGuide/Project3/{UCINETID}'}
+    RATE_LIMITER = NOMINATIM_RATE_LIMITER
+    RETRY_POLICY = NOMINATIM_RETRY_POLICY
+
+    #cached coordinates are rounded to about a meter
+    CACHE_PRECISION = 5
 
-    def __init__(self, coordinates):
+    def __init__(self, coordinates, cache=None, load: bool = True):
         self.lat, self.lon = coordinates
-        json_data = self.get_json_data()
-        self.json_data = json_data[0]
-        self.url = json_data[1]
+        self.cache = cache
+        self.json_data = None
+        self.url = None
+        if load:
+            self.load()
+
+    def load(self) -> 'ReverseGeocodingWithApi':
+        '''gets the data from the server (or the cache), which __init__ does
+        unless load is False'''
+        with instrumentation.span('geocoding.reverse'):
+            self.json_data, self.url = self.get_json_data()
+        return self
         
     def get_json_data(self) -> dict:
-        '''gets data from server and turns it into a dict'''
-        time.sleep(1)
+        '''gets data from server and turns it into a dict, unless a cache was
+        given that already has these coordinates'''
+        json_data = self._get_cached_json_data()
+        if json_data is not None:
+            return json_data
+
+        self.RATE_LIMITER.acquire()
         url = self._make_url(self.lat, self.lon)
         request = self._make_request(url)
         json_data = self._send_request(request)
+
+        self._cache_json_data(json_data)
         return json_data
 
+    def _make_cache_key(self) -> str:
+        return (f'reverse:{round(self.lat, self.CACHE_PRECISION)},'
+                f'{round(self.lon, self.CACHE_PRECISION)}')
+
+    def _get_cached_json_data(self) -> tuple:
+        '''returns the cached (json data, url) or None if there isn't one'''
+        if self.cache is None:
+            return None
+        json_data = self.cache.get(self._make_cache_key())
+        if json_data is None:
+            return None
+        return tuple(json_data)
+
+    def _cache_json_data(self, json_data: tuple) -> None:
+        if self.cache is not None:
+            self.cache.set(self._make_cache_key(), json_data)
+
     def _make_url(self, lat: float, lon: float) -> str:
         '''creates url to send to server'''
         encoded_params = urllib.parse.urlencode([('lat', lat), ('lon', lon),
@@ -126,13 +239,46 @@ class ReverseGeocodingWithApi:
         return urllib.request.Request(url, headers = self.HEADERS)
                                       
     def _send_request(self, request: urllib.request.Request) -> dict:
-        return class_utils.send_request(request)
+        return class_utils.send_request(request,
+                                        retry_policy=self.RETRY_POLICY)
 
     def get_location(self):
         '''gets location description based on server response'''
         return class_utils.access_json_data(self.json_data, ['display_name'],
                                             url=self.url)
 
+class ReverseGeocodingWithIndex:
+    '''reverse geocoding from a local gazetteer.Gazetteer instead of the
+    server. If the nearest place is more than MAX_DISTANCE km away, the
+    location comes from fallback, which is a ReverseGeocodingWithApi for the
+    same coordinates unless another geocoder is given'''
+    MAX_DISTANCE = 25.0
+
+    def __init__(self, coordinates, index, cache=None, fallback=None):
+        self.lat, self.lon = coordinates
+        self.index = index
+        self.place, self.distance = index.find_nearest(self.lat, self.lon)
+        self.fallback = None
+        if not self.found_place():
+            if fallback is None:
+                fallback = ReverseGeocodingWithApi(coordinates, cache=cache)
+            self.fallback = fallback
+
+    def found_place(self) -> bool:
+        '''true if the index has a place close enough to use'''
+        return self.place is not None and self.distance <= self.MAX_DISTANCE
+
+    def used_api(self) -> bool:
+        '''true if the location had to come from the fallback'''
+        return self.fallback is not None
+
+    def get_location(self) -> str:
+        '''gets the name of the nearest place, or the fallback's location if
+        there wasn't one close enough'''
+        if self.fallback is not None:
+            return self.fallback.get_location()
+        return self.place.name
+
 def format_coordinates(coordinates: tuple):
     '''formats the coordinates to match the requirements of ending in /N, /S,
     /E, or /W'''
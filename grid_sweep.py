@@ -0,0 +1,303 @@
+import argparse
+import batch_mode
+import collections
+import concurrent.futures
+import forecast_cache
+import gazetteer
+import geocoding
+import instrumentation
+import program_errors
+import sys
+import user_interface
+import weather_forecast
+import weather_utils
+
+#the most points looked up, or forecasts downloaded, at once
+DEFAULT_CONCURRENCY = 8
+
+#a bounding box is split into points this many degrees apart by default,
+#about 11 km, a few nws grids
+DEFAULT_STEP = 0.1
+
+#the result for one point of a sweep. grid is the GridForecast shared by
+#every point in the same nws grid, or None if error says why there isn't one
+SweepResult = collections.namedtuple('SweepResult',
+    ['name', 'latitude', 'longitude', 'grid', 'error'])
+
+
+class GridForecast:
+    '''the forecast of one nws grid, shared by every point of a sweep that
+    is in the grid. It answers queries like a WeatherForecastWithApi'''
+    def __init__(self, url: str, cached: forecast_cache.CachedForecast):
+        self.url = url
+        self._forecast = cached
+        self._average_coordinates = {}
+
+    def get_forecast_table(self, num_of_iterations: int = None):
+        if num_of_iterations is None:
+            return self._forecast.forecast_table
+        return self._forecast.forecast_table.prefix(num_of_iterations)
+
+    def get_coordinate_array(self):
+        return self._forecast.coordinates
+
+    def average_coordinates(self, area_weighted: bool = False) -> tuple:
+        '''the average corner of the grid, or its center if area_weighted
+        is true, worked out once for all of the grid's points'''
+        if area_weighted not in self._average_coordinates:
+            coordinates = self._forecast.coordinates
+            self._average_coordinates[area_weighted] = (
+                weather_forecast._get_centroid(coordinates) if area_weighted
+                else weather_forecast._get_average_coordinates(coordinates))
+        return self._average_coordinates[area_weighted]
+
+
+class _PointLookup(weather_forecast.WeatherForecastWithApi):
+    '''finds the forecast url of one point the same way (and through the
+    same grid cache) as WeatherForecastWithApi, but without downloading the
+    forecast when it is made, so a sweep can download each grid once'''
+    def __init__(self, latitude: float, longitude: float, grid_cache=None,
+                 response_cache=None):
+        super().__init__(latitude, longitude, grid_cache=grid_cache,
+                         response_cache=response_cache, load=False)
+
+
+class GridSweep:
+    '''gets the forecasts of many points at once. Points are rounded like
+    WeatherForecastWithApi rounds them and each different one is looked up
+    once (from the grid cache if it is there), then each different forecast
+    url is downloaded once and shared by all of its points. Lookups and
+    downloads run concurrency at a time. With a forecast cache, grids it
+    already has aren't downloaded again'''
+    def __init__(self, grid_cache=None, response_cache=None,
+                 forecast_cache=None, concurrency: int = DEFAULT_CONCURRENCY):
+        self.grid_cache = grid_cache
+        self.response_cache = response_cache
+        self.forecast_cache = forecast_cache
+        self.concurrency = concurrency
+
+    def sweep(self, places: list) -> list[SweepResult]:
+        '''returns a SweepResult for each gazetteer.Place, in the same order.
+        A point whose lookup or forecast fails gets the ApiFailureError, the
+        rest of the sweep carries on'''
+        lookups = {}
+        point_keys = []
+        for place in places:
+            lookup = _PointLookup(place.lat, place.lon, self.grid_cache,
+                                  self.response_cache)
+            key = (lookup.latitude, lookup.longitude)
+            lookups.setdefault(key, lookup)
+            point_keys.append(key)
+        instrumentation.count('sweep.points', len(places))
+        instrumentation.count('sweep.unique_points', len(lookups))
+
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency,
+                thread_name_prefix='grid-sweep') as executor:
+            with instrumentation.span('sweep.lookup'):
+                urls, failures = self._find_urls(lookups, executor)
+            with instrumentation.span('sweep.download'):
+                grids = self._download(urls, executor)
+
+            #a grid cache url that is gone means the grids were redrawn,
+            #those points are looked up again like WeatherForecastWithApi
+            #does
+            stale_lookups = {key: lookups[key] for key, (url, from_cache)
+                             in urls.items() if from_cache
+                             and _is_missing(grids.get(url))}
+            for lookup in stale_lookups.values():
+                self.grid_cache.delete(lookup._make_cache_key())
+            if stale_lookups:
+                with instrumentation.span('sweep.lookup'):
+                    new_urls, new_failures = self._find_urls(stale_lookups,
+                                                             executor)
+                urls.update(new_urls)
+                failures.update(new_failures)
+                for key in new_failures:
+                    del urls[key]
+                with instrumentation.span('sweep.download'):
+                    grids.update(self._download(urls, executor, grids))
+
+        for key, (url, from_cache) in urls.items():
+            grid = grids[url]
+            if not from_cache and isinstance(grid, GridForecast):
+                lookups[key]._cache_grid(url, grid._forecast.polygon)
+
+        results = []
+        for place, key in zip(places, point_keys):
+            if key in failures:
+                grid = failures[key]
+            else:
+                grid = grids[urls[key][0]]
+            if isinstance(grid, GridForecast):
+                results.append(SweepResult(place.name, place.lat, place.lon,
+                                           grid, None))
+            else:
+                results.append(SweepResult(place.name, place.lat, place.lon,
+                                           None, grid))
+        return results
+
+    def _find_urls(self, lookups: dict, executor) -> tuple:
+        '''returns (forecast url, whether it came from the grid cache) for
+        each point that was found, and the ApiFailureError for each point
+        that wasn't. Only the points the grid cache doesn't have are sent to
+        the pool'''
+        urls = {}
+        failures = {}
+        futures = {}
+        for key, lookup in lookups.items():
+            cached_url = lookup._get_cached_forecast_url()
+            if cached_url is not None:
+                urls[key] = (cached_url, True)
+            else:
+                futures[key] = executor.submit(lookup.get_forecast_url)
+
+        for key, future in futures.items():
+            try:
+                urls[key] = future.result()
+            except program_errors.ApiFailureError as e:
+                failures[key] = e
+        return (urls, failures)
+
+    def _download(self, urls: dict, executor, grids: dict = None) -> dict:
+        '''downloads every different url in urls that isn't in grids yet and
+        returns a GridForecast, or the ApiFailureError, for each url'''
+        if grids is None:
+            grids = {}
+        lookups = {}
+        for key, (url, from_cache) in urls.items():
+            if url not in grids and url not in lookups:
+                lookups[url] = _PointLookup(*key, self.grid_cache,
+                                            self.response_cache)
+        instrumentation.count('sweep.grids', len(lookups))
+
+        futures = {url: executor.submit(self._get_forecast, url, lookup)
+                   for url, lookup in lookups.items()}
+        downloaded = {}
+        for url, future in futures.items():
+            try:
+                downloaded[url] = GridForecast(url, future.result())
+            except program_errors.ApiFailureError as e:
+                downloaded[url] = e
+        return downloaded
+
+    def _get_forecast(self, url: str, lookup: _PointLookup
+                      ) -> forecast_cache.CachedForecast:
+        if self.forecast_cache is None:
+            return lookup._fetch_forecast(url)
+        return self.forecast_cache.get(url, lookup._fetch_forecast)
+
+
+def make_bbox_points(south: float, west: float, north: float, east: float,
+                     step: float = DEFAULT_STEP) -> list[gazetteer.Place]:
+    '''returns points step degrees apart covering the box, from the south
+    west corner, named by their coordinates'''
+    if step <= 0:
+        raise ValueError('step has to be more than 0')
+    #the tiny extra is so a box that is a whole number of steps wide still
+    #gets its east and north edges after float rounding
+    num_of_rows = int((north - south) / step + 1e-9) + 1
+    num_of_columns = int((east - west) / step + 1e-9) + 1
+
+    points = []
+    for row in range(num_of_rows):
+        lat = round(south + row * step, 4)
+        for column in range(num_of_columns):
+            lon = round(west + column * step, 4)
+            points.append(gazetteer.Place(f'{lat},{lon}', lat, lon))
+    return points
+
+def get_grid_centers(results: list, area_weighted: bool = False) -> dict:
+    '''works out the center of every different grid of a sweep once,
+    instead of once for each point in it, and returns them by forecast
+    url'''
+    grids = {result.grid.url: result.grid for result in results
+             if result.grid is not None}
+    return {url: grid.average_coordinates(area_weighted)
+            for url, grid in grids.items()}
+
+def answer_sweep(results: list, queries: list,
+                 area_weighted: bool = False) -> 'generator':
+    '''yields (point name, output lines) for each point: its coordinates,
+    its forecast location and the answers to the queries. Each grid's
+    queries are answered once and shared by its points. A point whose
+    forecast failed gets the failure message'''
+    centers = get_grid_centers(results, area_weighted)
+    answers = {}
+    for result in results:
+        point = geocoding.format_coordinates((result.latitude,
+                                              result.longitude))
+        output_lines = [f'POINT {point[0]} {point[1]}']
+        if result.grid is None:
+            yield (result.name,
+                   output_lines + result.error.get_failure_message())
+            continue
+
+        url = result.grid.url
+        if url not in answers:
+            try:
+                answers[url] = weather_utils.process_queries(queries,
+                                                             result.grid)
+            except (IndexError, ValueError) as e:
+                answers[url] = ['FAILED', 'INPUT', f'{type(e).__name__}: {e}']
+
+        center = geocoding.format_coordinates(centers[url])
+        output_lines.append(f'FORECAST {center[0]} {center[1]}')
+        yield (result.name, output_lines + answers[url])
+
+def _is_missing(grid) -> bool:
+    '''true if a download failed because the url is gone'''
+    return (isinstance(grid, program_errors.ApiFailureError)
+            and grid.status_code == 404)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='gets the forecasts of every point in a box or a list, '
+                    'downloading each nws grid once')
+    points = parser.add_mutually_exclusive_group(required=True)
+    points.add_argument('--bbox', type=float, nargs=4,
+        metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+        help='box to cover with points')
+    points.add_argument('--points',
+        help='.csv or json place list, like the ones REVERSE LOCAL reads')
+    parser.add_argument('--step', type=float, default=DEFAULT_STEP,
+        help='degrees between the points of a box, 0.1 by default')
+    parser.add_argument('--query', action='append', default=[],
+        help='query to answer for every point, like "WIND 24 MAX", can be '
+             'given more than once')
+    parser.add_argument('--concurrency', type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='number of lookups and downloads at once')
+    parser.add_argument('--area-weighted', action='store_true',
+        help='give the center of each grid instead of its average corner')
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+        help='one block of lines or one json line per point')
+    args = parser.parse_args()
+
+    try:
+        if args.points is not None:
+            places = gazetteer.load_places(args.points)
+        else:
+            places = make_bbox_points(*args.bbox, args.step)
+    except program_errors.FileFailureError as e:
+        e.print_failure_message()
+        return
+
+    export_format = instrumentation.configure_from_environment()
+    caches = user_interface.open_caches()
+    grid_sweep = GridSweep(caches.get('grid'), caches.get('responses'),
+                           caches.get('forecasts'), args.concurrency)
+    results = grid_sweep.sweep(places)
+
+    write_result = batch_mode.make_result_writer(sys.stdout, args.format)
+    for name, output_lines in answer_sweep(results, args.query,
+                                           args.area_weighted):
+        write_result(name, output_lines)
+    if args.format == 'text':
+        print(user_interface.NWS_ATTRIBUTION)
+
+    if export_format is not None:
+        instrumentation.export(export_format)
+
+
+if __name__ == '__main__':
+    main()
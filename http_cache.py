@@ -0,0 +1,152 @@
+import collections
+import email.utils
+import threading
+import time
+
+
+class CachedResponse:
+    '''a parsed response body along with what is needed to revalidate it'''
+    __slots__ = ('json_data', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, json_data, etag: str, last_modified: str,
+                 expires: float):
+        self.json_data = json_data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def is_fresh(self) -> bool:
+        '''true while the response's max-age or Expires hasn't passed'''
+        return time.time() < self.expires
+
+    def get_metadata(self) -> dict:
+        return {'etag': self.etag, 'last_modified': self.last_modified,
+                'expires': self.expires}
+
+
+class ResponseCache:
+    '''http cache for json responses. Fresh responses (per Cache-Control
+    max-age or Expires) are served without contacting the server, stale ones
+    are revalidated with If-None-Match/If-Modified-Since and a 304 reuses the
+    already parsed body. Parsed bodies of the most recently used
+    max_memory_entries urls are kept in memory, and everything is also written
+    to store (a persistent_cache.PersistentCache) if one is given so it
+    survives between runs'''
+    def __init__(self, store=None, max_memory_entries: int = 32):
+        self.store = store
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, url: str) -> CachedResponse:
+        '''returns the cached response for url, fresh or not, or None'''
+        cached = self._lookup(url)
+        if cached is not None and cached.is_fresh():
+            self.hits += 1
+        return cached
+
+    def _lookup(self, url: str) -> CachedResponse:
+        with self._lock:
+            cached = self._memory.get(url)
+            if cached is not None:
+                self._memory.move_to_end(url)
+                return cached
+
+        if self.store is None:
+            return None
+        metadata = self.store.get(f'meta:{url}')
+        if metadata is None:
+            return None
+        json_data = self.store.get(f'body:{url}')
+        if json_data is None:
+            return None
+
+        cached = CachedResponse(json_data, metadata['etag'],
+                                metadata['last_modified'], metadata['expires'])
+        self._remember(url, cached)
+        return cached
+
+    def get_conditional_headers(self, cached: CachedResponse) -> dict:
+        '''headers that ask the server to answer 304 if cached is still
+        current'''
+        headers = {}
+        if cached is not None:
+            if cached.etag is not None:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified is not None:
+                headers['If-Modified-Since'] = cached.last_modified
+        return headers
+
+    def store_response(self, url: str, json_data, headers) -> None:
+        '''caches a 200 response unless its Cache-Control says not to'''
+        self.misses += 1
+        expires = get_expiry(headers)
+        if expires is None:
+            return
+
+        cached = CachedResponse(json_data, headers.get('ETag'),
+                                headers.get('Last-Modified'), expires)
+        self._remember(url, cached)
+        if self.store is not None:
+            self.store.set(f'body:{url}', json_data)
+            self.store.set(f'meta:{url}', cached.get_metadata())
+
+    def update_response(self, url: str, cached: CachedResponse,
+                        headers) -> None:
+        '''updates the validators and expiry of cached after a 304. The body
+        is unchanged so only the metadata is written again'''
+        self.revalidations += 1
+        expires = get_expiry(headers)
+        cached.expires = time.time() if expires is None else expires
+        cached.etag = headers.get('ETag', cached.etag)
+        cached.last_modified = headers.get('Last-Modified',
+                                           cached.last_modified)
+        self._remember(url, cached)
+        if self.store is not None:
+            self.store.set(f'meta:{url}', cached.get_metadata())
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'revalidations': self.revalidations,
+                'misses': self.misses}
+
+    def _remember(self, url: str, cached: CachedResponse) -> None:
+        with self._lock:
+            self._memory[url] = cached
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+
+def get_expiry(headers) -> float:
+    '''returns when a response stops being fresh as seconds since the epoch,
+    or None if it shouldn't be cached at all. Responses without max-age or
+    Expires are stale right away but can still be revalidated'''
+    now = time.time()
+    directives = {}
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+
+    if 'no-store' in directives:
+        return None
+    if 'no-cache' in directives:
+        return now
+
+    if 'max-age' in directives:
+        try:
+            max_age = int(directives['max-age'])
+            age = int(headers.get('Age', 0))
+        except ValueError:
+            return now
+        return now + max(0, max_age - age)
+
+    expires = headers.get('Expires')
+    if expires is not None:
+        try:
+            return email.utils.parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return now
+    return now
@@ -0,0 +1,230 @@
+import concurrent.futures
+import email.utils
+import http.client
+import instrumentation
+import random
+import threading
+import time
+import urllib.parse
+
+#statuses that mean the server had a temporary problem, worth trying again
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+class CircuitOpenError(ConnectionError):
+    '''raised instead of sending a request to a host whose circuit breaker
+    is open. It is a ConnectionError so it is handled like the host being
+    unreachable'''
+    def __init__(self, url: str):
+        super().__init__(f'circuit breaker is open for {url}')
+        self.url = url
+
+
+class CircuitBreaker:
+    '''stops sending requests to a host after failure_threshold failures in
+    a row. Once reset_timeout seconds have passed one request is let
+    through as a trial: if it works the breaker closes again, otherwise it
+    stays open for another reset_timeout'''
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        '''true if a request may be sent now'''
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if (self._trial_running
+                    or self.clock() - self.opened_at < self.reset_timeout):
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    instrumentation.count('http.circuit_opened')
+                self.opened_at = self.clock()
+            self._trial_running = False
+
+    def get_state(self) -> str:
+        '''closed, open or half-open (waiting to let a trial through)'''
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+
+class RetryPolicy:
+    '''sends requests through a connection pool, trying again after network
+    errors and RETRY_STATUSES responses, up to max_attempts tries in all.
+    The wait before each retry is random, up to base_delay doubled for each
+    try so far (but at most max_delay and at least min_delay), unless the
+    server's Retry-After says how long to wait. A Retry-After longer than
+    max_retry_after isn't waited for. If hedge_after is given and a request
+    hasn't been answered after that many seconds, the same request is sent
+    again and whichever answers first is used. Each host gets a
+    CircuitBreaker so a host that is down fails right away. If a
+    rate_limiter is given, a token is taken from it before each retry, the
+    same as the caller takes one before the first try'''
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 8, min_delay: float = 0,
+                 max_retry_after: float = 30, hedge_after: float = None,
+                 failure_threshold: int = 5, reset_timeout: float = 30,
+                 retry_statuses: frozenset = RETRY_STATUSES,
+                 rate_limiter=None, sleep=time.sleep,
+                 random_number=random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_delay = min_delay
+        self.max_retry_after = max_retry_after
+        self.hedge_after = hedge_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry_statuses = retry_statuses
+        self.rate_limiter = rate_limiter
+        self.sleep = sleep
+        self.random_number = random_number
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def send(self, pool, url: str, headers: dict):
+        '''sends a GET request for url through pool and returns the
+        http_pool.HttpResponse. The last response is returned even if it is
+        still a RETRY_STATUSES one after every try. Raises what pool.request
+        raises if every try fails, or CircuitOpenError'''
+        breaker = self.get_breaker(url)
+        for attempt in range(self.max_attempts):
+            if not breaker.allow():
+                instrumentation.count('http.circuit_rejected')
+                raise CircuitOpenError(url)
+
+            is_last_attempt = attempt + 1 == self.max_attempts
+            if attempt > 0 and self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self._send_once(pool, url, headers)
+            except (OSError, http.client.HTTPException):
+                breaker.record_failure()
+                if is_last_attempt:
+                    raise
+                delay = self.get_delay(attempt)
+            except BaseException:
+                #anything else (like a body that can't be decompressed) still
+                #has to end a half-open trial, or the breaker never closes
+                breaker.record_failure()
+                raise
+            else:
+                #a 429 means the host is up, just busy
+                if response.status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+                if response.status not in self.retry_statuses or (
+                        is_last_attempt):
+                    return response
+                delay = self.get_delay(attempt, response.headers)
+                if delay is None:
+                    return response
+
+            instrumentation.count('http.retries')
+            with instrumentation.span('http.backoff'):
+                self.sleep(delay)
+
+    def get_delay(self, attempt: int, headers=None) -> float:
+        '''seconds to wait before retrying after try number attempt (from
+        0), or None if the server asked for a longer wait than
+        max_retry_after'''
+        retry_after = None
+        if headers is not None:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return max(self.min_delay, retry_after)
+
+        longest_delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return max(self.min_delay, self.random_number() * longest_delay)
+
+    def get_breaker(self, url: str) -> CircuitBreaker:
+        '''returns the circuit breaker for url's host'''
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold,
+                                         self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+    def _send_once(self, pool, url: str, headers: dict):
+        '''sends the request, and a second copy of it if hedge_after passes
+        without an answer'''
+        if self.hedge_after is None:
+            return pool.request(url, headers)
+
+        executor = _get_hedge_executor()
+        first_request = executor.submit(pool.request, url, headers)
+        try:
+            return first_request.result(timeout=self.hedge_after)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        instrumentation.count('http.hedged_requests')
+        second_request = executor.submit(pool.request, url, headers)
+        error = None
+        for request in concurrent.futures.as_completed((first_request,
+                                                        second_request)):
+            try:
+                return request.result()
+            except Exception as e:
+                error = e
+        raise error
+
+
+def parse_retry_after(retry_after: str) -> float:
+    '''reads a Retry-After header, which is either seconds or an http date,
+    as seconds from now. Returns None if there isn't one or it can't be
+    read'''
+    if retry_after is None:
+        return None
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_time = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+def _get_hedge_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=8, thread_name_prefix='hedged-request')
+        return _hedge_executor
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,215 @@
+import collections
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+#set WEATHER_METRICS to log, json or prometheus to turn instrumentation on
+#for run_program and get the metrics on stderr when it finishes
+ENVIRONMENT_VARIABLE = 'WEATHER_METRICS'
+EXPORT_FORMATS = ('log', 'json', 'prometheus')
+
+#everything checks this first, so instrumentation that is off costs one
+#global lookup
+ENABLED = False
+
+Timing = collections.namedtuple('Timing', ['name', 'start', 'duration',
+                                           'thread'])
+
+
+class Metrics:
+    '''counters and timers, safe to update from any thread. A timer keeps
+    how many times a stage ran, the total and the longest time. Collectors
+    are functions returning a dict of numbers, like the stats() of the
+    caches, that are read when a snapshot is taken'''
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = {}
+        self.collectors = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_time(self, name: str, duration: float) -> None:
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, duration, duration]
+            else:
+                timer[0] += 1
+                timer[1] += duration
+                timer[2] = max(timer[2], duration)
+
+    def add_collector(self, name: str, collector) -> None:
+        with self._lock:
+            self.collectors[name] = collector
+
+    def reset(self) -> None:
+        '''forgets the counters and timers, but keeps the collectors'''
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def snapshot(self) -> dict:
+        '''returns every counter, timer and collected value. A collector
+        with hits and misses also gets a hit_ratio'''
+        with self._lock:
+            counters = dict(self.counters)
+            timers = {name: {'count': count, 'total': total, 'max': longest}
+                      for name, (count, total, longest) in self.timers.items()}
+            collectors = dict(self.collectors)
+
+        gauges = {}
+        for name, collector in collectors.items():
+            values = dict(collector())
+            lookups = values.get('hits', 0) + values.get('misses', 0)
+            if 'hits' in values and lookups > 0:
+                values['hit_ratio'] = values['hits'] / lookups
+            gauges[name] = values
+        return {'counters': counters, 'timers': timers, 'gauges': gauges}
+
+
+class _Span:
+    '''times a with block and records it under name'''
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> '_Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        duration = time.perf_counter() - self.start
+        METRICS.record_time(self.name, duration)
+        if _hooks:
+            timing = Timing(self.name, self.start, duration,
+                            threading.current_thread().name)
+            for hook in _hooks:
+                hook(timing)
+
+
+class _NullSpan:
+    '''what span returns while instrumentation is off'''
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        pass
+
+
+METRICS = Metrics()
+_NULL_SPAN = _NullSpan()
+_hooks = []
+
+
+def enable() -> None:
+    global ENABLED
+    ENABLED = True
+
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+def span(name: str):
+    '''use as 'with instrumentation.span(name):' to time a stage. Does
+    nothing while instrumentation is off'''
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+def count(name: str, amount: int = 1) -> None:
+    '''adds amount to a counter, like bytes read or retries. Does nothing
+    while instrumentation is off'''
+    if ENABLED:
+        METRICS.count(name, amount)
+
+def add_collector(name: str, collector) -> None:
+    '''reads collector() (a dict of numbers) into every snapshot, under
+    name'''
+    METRICS.add_collector(name, collector)
+
+def add_hook(hook) -> None:
+    '''calls hook(Timing) every time a span finishes, for tracing'''
+    _hooks.append(hook)
+
+def remove_hook(hook) -> None:
+    _hooks.remove(hook)
+
+def snapshot() -> dict:
+    return METRICS.snapshot()
+
+def format_log_line(metrics: dict) -> str:
+    '''one line of name=value pairs, times in milliseconds'''
+    pairs = [f'{name}={value}'
+             for name, value in sorted(metrics['counters'].items())]
+    for name, timer in sorted(metrics['timers'].items()):
+        pairs.append(f'{name}.count={timer["count"]}')
+        pairs.append(f'{name}.total_ms={timer["total"] * 1000:.3f}')
+        pairs.append(f'{name}.max_ms={timer["max"] * 1000:.3f}')
+    for name, values in sorted(metrics['gauges'].items()):
+        for key, value in sorted(values.items()):
+            pairs.append(f'{name}.{key}={_format_number(value)}')
+    return ' '.join(pairs)
+
+def format_json(metrics: dict) -> str:
+    return json.dumps(metrics, sort_keys=True)
+
+def format_prometheus(metrics: dict, prefix: str = 'weather') -> str:
+    '''the prometheus text exposition format. Counters become
+    <prefix>_<name>_total, timers become summaries in seconds and collected
+    values become gauges'''
+    lines = []
+    for name, value in sorted(metrics['counters'].items()):
+        metric = f'{prefix}_{_to_metric_name(name)}_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+
+    for name, timer in sorted(metrics['timers'].items()):
+        metric = f'{prefix}_{_to_metric_name(name)}_seconds'
+        lines.append(f'# TYPE {metric} summary')
+        lines.append(f'{metric}_count {timer["count"]}')
+        lines.append(f'{metric}_sum {_format_number(timer["total"])}')
+        lines.append(f'# TYPE {metric}_max gauge')
+        lines.append(f'{metric}_max {_format_number(timer["max"])}')
+
+    for name, values in sorted(metrics['gauges'].items()):
+        for key, value in sorted(values.items()):
+            metric = f'{prefix}_{_to_metric_name(name)}_{_to_metric_name(key)}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+def export(export_format: str, output=None) -> None:
+    '''writes a snapshot to output (stderr by default) as a log line, json
+    or prometheus text'''
+    if output is None:
+        output = sys.stderr
+    formatters = {'log': format_log_line, 'json': format_json,
+                  'prometheus': format_prometheus}
+    text = formatters[export_format](snapshot())
+    output.write(text if text.endswith('\n') else text + '\n')
+
+def configure_from_environment() -> str:
+    '''turns instrumentation on if WEATHER_METRICS names an export format,
+    and returns the format, or None'''
+    export_format = os.environ.get(ENVIRONMENT_VARIABLE, '').strip().lower()
+    if export_format not in EXPORT_FORMATS:
+        return None
+    enable()
+    return export_format
+
+def _to_metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+def _format_number(value) -> str:
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,62 @@
+import instrumentation
+import json
+import mmap
+
+#the fastest json library that is installed is used, the standard json
+#module is always there to fall back on
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+elif simdjson is not None:
+    BACKEND = 'simdjson'
+else:
+    BACKEND = 'json'
+
+
+def loads(data):
+    '''decodes json from bytes (or anything bytes-like, or a str). orjson
+    parses bytes as they are, the standard json module decodes them to a str
+    first. Raises ValueError if data isn't valid utf-8 json, which is what
+    json.JSONDecodeError, orjson's errors and UnicodeDecodeError all are'''
+    instrumentation.count('json.bytes_decoded', len(data))
+    with instrumentation.span('json.decode'):
+        if BACKEND == 'orjson':
+            return orjson.loads(data)
+        elif BACKEND == 'simdjson':
+            return simdjson.loads(_to_bytes(data))
+        return json.loads(_to_bytes(data))
+
+def load_file(file_name: str):
+    '''decodes a json file. With orjson the file is memory-mapped and parsed
+    straight from the page cache, the other backends need bytes so the file
+    is just read. Raises OSError if the file can't be opened and ValueError
+    if it isn't valid json'''
+    with open(file_name, 'rb') as file:
+        if BACKEND != 'orjson':
+            return loads(file.read())
+        try:
+            mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            #empty files can't be mapped
+            return loads(file.read())
+
+        with mapped_file:
+            instrumentation.count('json.bytes_decoded', len(mapped_file))
+            with instrumentation.span('json.decode'):
+                with memoryview(mapped_file) as data:
+                    return orjson.loads(data)
+
+def _to_bytes(data):
+    '''json and simdjson take str or bytes but not other buffers'''
+    if isinstance(data, (str, bytes, bytearray)):
+        return data
+    return bytes(data)
@@ -0,0 +1,104 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+#the per-user directory the caches (and the nominatim rate limit lock) go in
+CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache',
+                               'weather-api-project')
+
+
+class PersistentCache:
+    '''key/value cache kept in a sqlite file so it lasts between runs. Values
+    are stored as json. Entries older than ttl seconds are treated as missing,
+    and once there are more than max_entries the least recently used ones are
+    removed. hits and misses count how often get found something'''
+    def __init__(self, path: str, ttl: float = None, max_entries: int = None,
+                 table: str = 'cache'):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, '
+            'value TEXT NOT NULL, created REAL NOT NULL, '
+            'last_used REAL NOT NULL)')
+        self._connection.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_last_used '
+            f'ON {table} (last_used)')
+
+    def get(self, key: str):
+        '''returns the value stored under key, or None if there isn't one or
+        it is older than the ttl'''
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT value, created FROM {self.table} WHERE key = ?',
+                (key,)).fetchone()
+
+            if row is not None and self.ttl is not None and (
+                    now - row[1] > self.ttl):
+                self._connection.execute(
+                    f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                f'UPDATE {self.table} SET last_used = ? WHERE key = ?',
+                (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value) -> None:
+        '''stores value under key and evicts the least recently used entries
+        if the cache is over max_entries'''
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} '
+                '(key, value, created, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now))
+
+            if self.max_entries is not None:
+                self._connection.execute(
+                    f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM '
+                    f'{self.table} ORDER BY last_used LIMIT MAX(0, (SELECT '
+                    f'COUNT(*) FROM {self.table}) - ?))', (self.max_entries,))
+
+    def delete(self, key: str) -> None:
+        '''removes key from the cache if it is there'''
+        with self._lock:
+            self._connection.execute(
+                f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def clear(self) -> None:
+        '''removes every entry'''
+        with self._lock:
+            self._connection.execute(f'DELETE FROM {self.table}')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def stats(self) -> dict:
+        '''returns the hit and miss counts and the number of entries'''
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
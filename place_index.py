@@ -0,0 +1,179 @@
+import argparse
+import functools
+import gazetteer
+import os
+import pathlib
+import program_errors
+import sqlite3
+import threading
+import unicodedata
+
+#a fuzzy match has to share at least this share of its trigrams with the
+#description to be used
+MIN_SIMILARITY = 0.5
+
+#how many of the places sharing the most trigrams are compared
+FUZZY_CANDIDATES = 50
+
+#the index is read through a memory map of up to this many bytes
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+class PlaceIndex:
+    '''a place list saved by build_index, for looking up the coordinates of
+    a description without asking nominatim. The index is a sqlite file with
+    each place's normalized name and its trigrams indexed, and it is read
+    through a memory map so opening it doesn't load it. Lookups try the
+    exact name, then names whose first words are the description, then the
+    name sharing the most trigrams with it'''
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.isfile(path):
+            raise program_errors.FileFailureError(path, 'missing')
+        #as_uri quotes characters like ? # % that mean something in a uri
+        uri = pathlib.Path(path).resolve().as_uri() + '?mode=ro'
+        try:
+            self._connection = sqlite3.connect(uri, uri=True,
+                                               check_same_thread=False)
+            self._connection.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+            self._connection.execute('SELECT id FROM places LIMIT 1')
+        except sqlite3.DatabaseError:
+            raise program_errors.FileFailureError(path, 'format')
+
+    def find(self, description: str) -> gazetteer.Place:
+        '''returns the place best matching description, or None if nothing
+        is close enough'''
+        key = normalize_name(description)
+        if key == '':
+            return None
+        with self._lock:
+            return (self._find_exact(key) or self._find_prefix(key)
+                    or self._find_fuzzy(key))
+
+    def _find_exact(self, key: str) -> gazetteer.Place:
+        return self._to_place(self._connection.execute(
+            'SELECT name, lat, lon FROM places WHERE key = ? ORDER BY id '
+            'LIMIT 1', (key,)).fetchone())
+
+    def _find_prefix(self, key: str) -> gazetteer.Place:
+        '''the shortest name starting with the description, since 'irvine'
+        most likely means 'irvine california' and not a longer name'''
+        return self._to_place(self._connection.execute(
+            'SELECT name, lat, lon FROM places WHERE key > ? AND key < ? '
+            'ORDER BY length(key), id LIMIT 1',
+            (key + ' ', key + ' \U0010ffff')).fetchone())
+
+    def _find_fuzzy(self, key: str) -> gazetteer.Place:
+        '''the place with the highest jaccard similarity between its
+        trigrams and the description's'''
+        trigrams = get_trigrams(key)
+        placeholders = ', '.join('?' * len(trigrams))
+        candidates = self._connection.execute(
+            'SELECT places.name, places.lat, places.lon, places.trigram_count,'
+            ' matches.shared FROM (SELECT place_id, COUNT(*) AS shared FROM '
+            f'trigrams WHERE trigram IN ({placeholders}) GROUP BY place_id '
+            'ORDER BY shared DESC, place_id LIMIT ?) AS matches JOIN places '
+            'ON places.id = matches.place_id ORDER BY places.id',
+            (*trigrams, FUZZY_CANDIDATES)).fetchall()
+
+        best_place = None
+        best_similarity = MIN_SIMILARITY
+        for name, lat, lon, trigram_count, shared in candidates:
+            similarity = shared / (len(trigrams) + trigram_count - shared)
+            if similarity >= best_similarity and (best_place is None
+                    or similarity > best_similarity):
+                best_place = gazetteer.Place(name, lat, lon)
+                best_similarity = similarity
+        return best_place
+
+    def _to_place(self, row: tuple) -> gazetteer.Place:
+        if row is None:
+            return None
+        return gazetteer.Place(*row)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+#batch and service runs ask for the same index for every target
+@functools.lru_cache(maxsize=8)
+def open_place_index(path: str) -> PlaceIndex:
+    '''opens an index once per process'''
+    return PlaceIndex(path)
+
+def build_index(places_file: str, path: str) -> int:
+    '''reads a place file like gazetteer.load_places does and saves it as an
+    index at path, replacing any index already there. Returns the number of
+    places'''
+    places = gazetteer.load_places(places_file)
+    temporary_path = f'{path}.building'
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+    connection = sqlite3.connect(temporary_path)
+    try:
+        connection.execute(
+            'CREATE TABLE places (id INTEGER PRIMARY KEY, name TEXT NOT NULL,'
+            ' key TEXT NOT NULL, lat REAL NOT NULL, lon REAL NOT NULL, '
+            'trigram_count INTEGER NOT NULL)')
+        connection.execute(
+            'CREATE TABLE trigrams (trigram TEXT NOT NULL, place_id INTEGER '
+            'NOT NULL, PRIMARY KEY (trigram, place_id)) WITHOUT ROWID')
+
+        with connection:
+            for place_id, place in enumerate(places):
+                key = normalize_name(place.name)
+                trigrams = get_trigrams(key)
+                connection.execute(
+                    'INSERT INTO places VALUES (?, ?, ?, ?, ?, ?)',
+                    (place_id, place.name, key, place.lat, place.lon,
+                     len(trigrams)))
+                connection.executemany(
+                    'INSERT INTO trigrams VALUES (?, ?)',
+                    ((trigram, place_id) for trigram in trigrams))
+
+        connection.execute('CREATE INDEX places_key ON places (key)')
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
+
+    os.replace(temporary_path, path)
+    return len(places)
+
+def normalize_name(name: str) -> str:
+    '''lowercases name, drops accents and punctuation and squeezes spaces,
+    so 'San José, CA' and 'san jose ca' are the same name'''
+    decomposed = unicodedata.normalize('NFKD', name.lower())
+    characters = [character if character.isalnum() else ' '
+                  for character in decomposed
+                  if not unicodedata.combining(character)]
+    return ' '.join(''.join(characters).split())
+
+def get_trigrams(key: str) -> list[str]:
+    '''the different 3 letter pieces of a normalized name, with a space added
+    on each end so the starts and ends of words count too'''
+    padded = f' {key} '
+    return sorted({padded[index:index + 3]
+                   for index in range(len(padded) - 2)})
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='builds a place index for TARGET LOCAL')
+    parser.add_argument('places_file',
+        help='.csv or json place list, like the ones REVERSE LOCAL reads')
+    parser.add_argument('index_file',
+        help='where to save the index')
+    args = parser.parse_args()
+
+    try:
+        number_of_places = build_index(args.places_file, args.index_file)
+    except program_errors.FileFailureError as e:
+        e.print_failure_message()
+        return
+    print(f'{number_of_places} places saved to {args.index_file}')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,13 +8,19 @@ class ApiFailureError(Exception):
     def print_failure_message(self) -> None:
         '''prints faliure message including last visited url and reason for
         failure'''
-        print('FAILED')
+        for line in self.get_failure_message():
+            print(line)
+
+    def get_failure_message(self) -> list[str]:
+        '''returns the lines of the failure message'''
+        failure_message = ['FAILED']
         if self.status_code != None:
-            print(f'{self.status_code} {self.url}')
+            failure_message.append(f'{self.status_code} {self.url}')
         else:
-            print(self.url)
+            failure_message.append(self.url)
 
-        print(self.api_error.upper())
+        failure_message.append(self.api_error.upper())
+        return failure_message
        
 class FileFailureError(Exception):
     '''exception raised when problems related to reading from a file occur'''
@@ -24,7 +30,10 @@ class FileFailureError(Exception):
 
     def print_failure_message(self) -> None:
         '''prints failure message and includes file name'''
-        print('FAILED')
-        print(f'{self.file_path}')
-        print(self.file_error.upper())
+        for line in self.get_failure_message():
+            print(line)
+
+    def get_failure_message(self) -> list[str]:
+        '''returns the lines of the failure message'''
+        return ['FAILED', f'{self.file_path}', self.file_error.upper()]
 
@@ -0,0 +1,128 @@
+import asyncio
+import instrumentation
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    #no fcntl on windows, so the limiter is only shared between threads there
+    fcntl = None
+
+
+class RateLimiter:
+    '''token bucket that allows rate requests per second with bursts of up to
+    capacity requests. A request only waits if the bucket is empty, so calls
+    that are already spaced out don't wait at all. The bucket is shared by
+    every thread using the limiter, and by every process using the same
+    lock_file if one is given. If the lock file can't be used the bucket is
+    only shared between threads'''
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0,
+                 lock_file: str = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.lock_file = lock_file
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = time.time()
+
+    def acquire(self) -> None:
+        '''takes a token, sleeping until one is available if needed'''
+        delay = self.reserve()
+        if delay > 0:
+            instrumentation.count('rate_limiter.waits')
+            with instrumentation.span('rate_limiter.wait'):
+                time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        '''same as acquire but waits with asyncio.sleep so other tasks keep
+        running'''
+        delay = self.reserve()
+        if delay > 0:
+            instrumentation.count('rate_limiter.waits')
+            with instrumentation.span('rate_limiter.wait'):
+                await asyncio.sleep(delay)
+
+    def reserve(self) -> float:
+        '''takes a token and returns how many seconds the caller has to wait
+        before using it. The token is taken right away, so later callers line
+        up behind this one even before it has finished waiting'''
+        with self._lock:
+            if self.lock_file is None or fcntl is None:
+                return self._take_token()
+
+            #a read only home, a file that isn't ours or a file system that
+            #can't lock shouldn't stop the lookups, just the sharing with
+            #other processes
+            try:
+                file = self._open_lock_file()
+            except OSError:
+                return self._stop_sharing()
+
+            with file:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX)
+                except OSError:
+                    return self._stop_sharing()
+                try:
+                    self._read_state(file)
+                    delay = self._take_token()
+                    try:
+                        self._write_state(file)
+                    except OSError:
+                        instrumentation.count('rate_limiter.lock_file_errors')
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+            return delay
+
+    def _stop_sharing(self) -> float:
+        '''stops using the lock file after an error with it and takes a token
+        from this process's bucket instead'''
+        instrumentation.count('rate_limiter.lock_file_errors')
+        self.lock_file = None
+        return self._take_token()
+
+    def _open_lock_file(self):
+        '''opens the lock file for reading and writing, creating it (and its
+        directory) so only this user can use it. A symlink in its place is
+        refused instead of followed'''
+        os.makedirs(os.path.dirname(self.lock_file) or '.', mode=0o700,
+                    exist_ok=True)
+        file_descriptor = os.open(self.lock_file,
+            os.O_CREAT | os.O_RDWR | os.O_NOFOLLOW, 0o600)
+        try:
+            return os.fdopen(file_descriptor, 'r+')
+        except BaseException:
+            os.close(file_descriptor)
+            raise
+
+    def _take_token(self) -> float:
+        '''refills the bucket for the time since the last token was taken,
+        then takes one. A negative bucket means requests are queued up'''
+        now = time.time()
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    def _read_state(self, file) -> None:
+        '''loads the bucket another process may have left in the lock file'''
+        file.seek(0)
+        try:
+            tokens, updated = file.read().split()
+            self._tokens = float(tokens)
+            self._updated = float(updated)
+        except ValueError:
+            #empty or damaged file, start with a full bucket
+            self._tokens = self.capacity
+            self._updated = time.time()
+
+    def _write_state(self, file) -> None:
+        file.seek(0)
+        file.truncate()
+        file.write(f'{self._tokens!r} {self._updated!r}')
+        file.flush()
@@ -0,0 +1,253 @@
+import argparse
+import batch_mode
+import collections
+import concurrent.futures
+import http.server
+import instrumentation
+import itertools
+import json
+import socket
+import threading
+import time
+import user_interface
+
+#requests bigger than this are turned away
+MAX_REQUEST_BYTES = 1024 * 1024
+
+#latency percentiles are worked out over this many of the latest requests
+LATENCY_WINDOW = 1000
+
+#a client that sends nothing for this many seconds is disconnected, so it
+#can't hold a worker
+REQUEST_TIMEOUT = 30
+
+#connections waiting for a worker past this many are turned away with a 503
+MAX_PENDING_REQUESTS = 64
+
+_BUSY_RESPONSE = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                  b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+
+
+class ServiceStats:
+    '''counts requests and keeps the latency of the latest LATENCY_WINDOW
+    of them, for /stats'''
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.failures = 0
+        self.statuses = collections.Counter()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, status: int, latency: float, failed: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.statuses[status] += 1
+            if failed:
+                self.failures += 1
+            self._latencies.append(latency)
+
+    def get_stats(self) -> dict:
+        '''returns the request counts, requests per second since the service
+        started and latency percentiles in milliseconds'''
+        with self._lock:
+            latencies = sorted(self._latencies)
+            uptime = time.time() - self.started
+            stats = {'uptime': uptime, 'requests': self.requests,
+                     'failures': self.failures,
+                     'requests_per_second': self.requests / uptime,
+                     'statuses': {str(status): number for status, number
+                                  in sorted(self.statuses.items())}}
+
+        stats['latency_ms'] = {
+            'p50': _get_percentile(latencies, 50) * 1000,
+            'p90': _get_percentile(latencies, 90) * 1000,
+            'p99': _get_percentile(latencies, 99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000}
+        return stats
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    '''http server that handles each request on one of a fixed number of
+    worker threads, instead of starting a thread for every request like
+    ThreadingHTTPServer, so a burst of requests can't start more lookups at
+    once than there are workers. At most max_pending connections wait for
+    a worker, the ones past that are answered with a 503 right away'''
+    def __init__(self, address: tuple, handler, workers: int = 8,
+                 max_pending: int = MAX_PENDING_REQUESTS):
+        super().__init__(address, handler)
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers,
+            thread_name_prefix='service-worker')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def process_request(self, request, client_address) -> None:
+        if not self._slots.acquire(blocking=False):
+            instrumentation.count('service.turned_away')
+            try:
+                request.sendall(_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+class WeatherService(PooledHTTPServer):
+    '''keeps the caches (and the connection pool every request shares) open
+    between requests:
+
+    POST /forecast  a json job like batch_mode reads, answered with
+                    {"output": [...the lines run_program would print...]}
+    GET /stats      request counts, throughput, latency and cache stats
+    GET /metrics    instrumentation metrics in prometheus text format
+    GET /health     200 while the service is up
+
+    FILE inputs read files on this machine, so the service should only be
+    reachable by clients that are allowed to do that'''
+    def __init__(self, address: tuple, workers: int = 8, caches: dict = None):
+        super().__init__(address, WeatherRequestHandler, workers)
+        if caches is None:
+            caches = user_interface.open_caches()
+        self.caches = caches
+        self.stats = ServiceStats()
+        self.job_numbers = itertools.count(1)
+
+    def get_stats(self) -> dict:
+        stats = self.stats.get_stats()
+        stats['caches'] = {name: cache.stats()
+                           for name, cache in self.caches.items()}
+        return stats
+
+
+class WeatherRequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = 'WeatherService/1.0'
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self) -> None:
+        start = time.perf_counter()
+        if self.path == '/stats':
+            self._send_json(200, self.server.get_stats())
+        elif self.path == '/metrics':
+            self._send_text(200, instrumentation.format_prometheus(
+                instrumentation.snapshot()))
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f'no such page {self.path}'})
+            self._record(404, start)
+            return
+        self._record(200, start)
+
+    def do_POST(self) -> None:
+        start = time.perf_counter()
+        if self.path != '/forecast':
+            self._send_json(404, {'error': f'no such page {self.path}'})
+            self._record(404, start)
+            return
+
+        status, response = self._answer_forecast()
+        self._send_json(status, response)
+        self._record(status, start, response.get('failed', False))
+
+    def _answer_forecast(self) -> tuple:
+        '''returns the status and json response for a /forecast request.
+        A failed api or file is still a 200, with the failure message as
+        the output, like run_program would print it'''
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            return (411, {'error': 'Content-Length is needed'})
+        if length < 0:
+            return (400, {'error': "Content-Length can't be negative"})
+        if length > MAX_REQUEST_BYTES:
+            return (413, {'error': 'request is too big'})
+
+        try:
+            body = self.rfile.read(length)
+        except socket.timeout:
+            self.close_connection = True
+            return (408, {'error': 'request body took too long'})
+
+        try:
+            job_spec = json.loads(body)
+            job = batch_mode.make_json_job(job_spec,
+                                           next(self.server.job_numbers))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return (400, {'error': f'bad job: {type(e).__name__}: {e}'})
+
+        try:
+            with instrumentation.span('service.forecast'):
+                output = user_interface.get_output_lines(job.input_list,
+                                                         self.server.caches)
+        except (IndexError, KeyError, ValueError) as e:
+            return (400, {'id': job.job_id,
+                          'error': f'bad input: {type(e).__name__}: {e}'})
+        return (200, {'id': job.job_id, 'output': output,
+                      'failed': output[:1] == ['FAILED']})
+
+    def _send_json(self, status: int, response: dict) -> None:
+        self._send(status, json.dumps(response).encode(), 'application/json')
+
+    def _send_text(self, status: int, text: str) -> None:
+        self._send(status, text.encode(), 'text/plain; version=0.0.4')
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _record(self, status: int, start: float, failed: bool = False
+                ) -> None:
+        self.server.stats.record(status, time.perf_counter() - start,
+                                 failed or status >= 400)
+
+    def log_message(self, format: str, *args) -> None:
+        '''requests are counted in /stats instead of logged'''
+
+
+def _get_percentile(sorted_values: list, percentile: float) -> float:
+    '''nearest-rank percentile, 0 if there are no values'''
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+    return sorted_values[int(rank) - 1]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='answers weather jobs over http, keeping caches warm')
+    parser.add_argument('--host', default='127.0.0.1',
+        help='address to listen on, 127.0.0.1 by default')
+    parser.add_argument('--port', type=int, default=8080,
+        help='port to listen on, 8080 by default')
+    parser.add_argument('--workers', type=int, default=8,
+        help='number of requests handled at once')
+    args = parser.parse_args()
+
+    instrumentation.enable()
+    service = WeatherService((args.host, args.port), args.workers)
+    print(f'listening on http://{args.host}:{service.server_address[1]}')
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+
+
+if __name__ == '__main__':
+    main()
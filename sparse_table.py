@@ -0,0 +1,66 @@
+import array
+
+
+class SparseTable:
+    '''finds the first MAX or MIN of any range of values in constant time.
+    Level k holds, for every index i, the index of the first extreme of
+    values[i:i + 2 ** k], so building it takes about n log2(n) steps and any
+    range is covered by two (overlapping) blocks from one level. Missing
+    (nan) values are skipped'''
+    def __init__(self, values, limit: str):
+        self.values = values
+        self.is_max = limit == 'MAX'
+        self.length = len(values)
+
+        #missing values become the worst possible value, so they are only
+        #picked for a block with nothing else in it
+        missing = float('-inf') if self.is_max else float('inf')
+        keys = [value if value == value else missing for value in values]
+        self._keys = keys
+
+        level = list(range(self.length))
+        self._levels = [level]
+        width = 1
+        while width * 2 <= self.length:
+            right_level = level[width:]
+            if self.is_max:
+                level = [left if keys[left] >= keys[right] else right
+                         for left, right in zip(level, right_level)]
+            else:
+                level = [left if keys[left] <= keys[right] else right
+                         for left, right in zip(level, right_level)]
+            self._levels.append(level)
+            width *= 2
+
+    def find(self, start: int, end: int) -> int:
+        '''returns the index of the first extreme of values[start:end], or -1
+        if there are no values in the range. The range is clipped to the
+        values like a slice would be'''
+        start = max(0, start)
+        end = min(end, self.length)
+        if start >= end:
+            return -1
+        level_num = (end - start).bit_length() - 1
+        level = self._levels[level_num]
+        left = level[start]
+        right = level[end - (1 << level_num)]
+
+        #the left block starts first, so it wins a tie
+        keys = self._keys
+        if self.is_max:
+            index = left if keys[left] >= keys[right] else right
+        else:
+            index = left if keys[left] <= keys[right] else right
+        value = self.values[index]
+        return index if value == value else -1
+
+
+def rolling_extreme_indexes(values, window: int, limit: str,
+                            step: int = 1) -> array.array:
+    '''returns the index of the first MAX or MIN of values[i:i + window] for
+    i = 0, step, 2 * step, ... while a whole window fits, like the highest
+    temperature of every 24 hours. A window of only missing values is -1'''
+    sparse_table = SparseTable(values, limit)
+    return array.array('q', (sparse_table.find(start, start + window)
+                             for start in range(0, len(values) - window + 1,
+                                                step)))
@@ -0,0 +1,75 @@
+import forecast_extract
+import json
+import unittest
+import unittest.mock
+
+
+def _make_document() -> str:
+    '''a small forecast with numbers in every form json has, and text that
+    isn't ascii, so chunk boundaries land inside numbers and inside multi
+    byte characters'''
+    periods = [{'number': number, 'name': 'Mañana ☀',
+                'startTime': f'2024-11-08T{number:02}:00:00-08:00',
+                'temperature': 60 - number * 1.5,
+                'relativeHumidity': {'unitCode': 'wmoUnit:percent',
+                                     'value': 40 + number},
+                'windSpeed': f'{number} mph', 'windDirection': 'NNE',
+                'probabilityOfPrecipitation': {'value': None}}
+               for number in range(6)]
+    document = {'@context': ['x'], 'type': 'Feature',
+                'properties': {'units': 'us', 'elevation': {'value': -1250.5},
+                               'scale': 1.5e-07, 'big': 1E+20, 'flag': True,
+                               'updateTime': '2024-11-08T00:12:24+00:00',
+                               'validTimes': '2024-11-07T18:00:00+00:00/P7D',
+                               'periods': periods},
+                'geometry': {'type': 'Polygon',
+                             'coordinates': [[[-117.85, 33.66],
+                                              [-117.86, 33.67],
+                                              [-117.84, 33.68],
+                                              [-117.85, 33.66]]]}}
+    return json.dumps(document, indent=1, ensure_ascii=False)
+
+
+class ExtractForecastTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.text = _make_document()
+        self.data = self.text.encode()
+
+    def test_matches_full_document(self) -> None:
+        forecast = forecast_extract.extract_forecast(self.data)
+        document = json.loads(self.text)
+        self.assertEqual(forecast['geometry'], document['geometry'])
+        self.assertEqual(forecast['properties']['updateTime'],
+                         document['properties']['updateTime'])
+        self.assertNotIn('units', forecast['properties'])
+        self.assertEqual(forecast['properties']['periods'][2],
+            {key: document['properties']['periods'][2][key]
+             for key in forecast_extract.PERIOD_KEYS})
+
+    def test_max_periods(self) -> None:
+        forecast = forecast_extract.extract_forecast(self.data, 2)
+        self.assertEqual(len(forecast['properties']['periods']), 2)
+        self.assertIn('geometry', forecast)
+
+    def test_split_at_every_offset(self) -> None:
+        expected = {max_periods: forecast_extract.extract_forecast(self.text,
+                                                                   max_periods)
+                    for max_periods in (0, 3, 100)}
+        for offset in range(1, len(self.data) + 1):
+            with unittest.mock.patch.object(forecast_extract, 'CHUNK_SIZE',
+                                            offset):
+                for max_periods, forecast in expected.items():
+                    with self.subTest(offset=offset, max_periods=max_periods):
+                        self.assertEqual(forecast_extract.extract_forecast(
+                            self.data, max_periods), forecast)
+
+    def test_invalid_documents(self) -> None:
+        for data in (b'', b'{', b'{"properties": {"x": 1.}}', b'{} x',
+                     b'\xff{}', self.data[:-1]):
+            with self.subTest(data=data[-20:]):
+                with self.assertRaises(ValueError):
+                    forecast_extract.extract_forecast(data, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
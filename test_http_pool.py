@@ -0,0 +1,176 @@
+import class_utils
+import gzip
+import http.server
+import http_pool
+import http_retry
+import program_errors
+import threading
+import unittest
+import urllib.request
+import zlib
+
+
+class _FakeServer(http.server.BaseHTTPRequestHandler):
+    '''answers every path with the next (status, headers, body) in
+    responses, or a 200 once they run out, and remembers each request's
+    path, headers and client port. With close_after_response the connection
+    is closed without telling the client, like a server dropping an idle
+    keep-alive connection'''
+    protocol_version = 'HTTP/1.1'
+    responses = []
+    requests = []
+    close_after_response = False
+
+    def do_GET(self) -> None:
+        _FakeServer.requests.append((self.path, dict(self.headers),
+                                     self.client_address[1]))
+        if _FakeServer.responses:
+            status, headers, body = _FakeServer.responses.pop(0)
+        else:
+            status, headers, body = (200, {}, b'{"ok": true}')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if _FakeServer.close_after_response:
+            self.close_connection = True
+
+    def do_CONNECT(self) -> None:
+        _FakeServer.requests.append((self.path, dict(self.headers),
+                                     self.client_address[1]))
+        self.send_error(403)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class _ServerTest(unittest.TestCase):
+    '''starts a _FakeServer for the tests of a subclass'''
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     _FakeServer)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.address = f'127.0.0.1:{cls.server.server_address[1]}'
+        cls.url = f'http://{cls.address}/x'
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        _FakeServer.responses = []
+        _FakeServer.requests = []
+        _FakeServer.close_after_response = False
+        self.pool = http_pool.ConnectionPool(proxies={})
+
+    def tearDown(self) -> None:
+        self.pool.close()
+
+
+class ConnectionPoolTest(_ServerTest):
+    def get_client_ports(self) -> list:
+        return [port for path, headers, port in _FakeServer.requests]
+
+    def test_reuses_connection(self) -> None:
+        for request_num in range(3):
+            self.assertEqual(self.pool.request(self.url).body,
+                             b'{"ok": true}')
+        self.assertEqual(len(set(self.get_client_ports())), 1)
+
+    def test_reconnects_after_server_closes(self) -> None:
+        _FakeServer.close_after_response = True
+        self.assertEqual(self.pool.request(self.url).status, 200)
+        self.assertEqual(self.pool.request(self.url).status, 200)
+        self.assertEqual(len(set(self.get_client_ports())), 2)
+
+    def test_follows_redirects(self) -> None:
+        _FakeServer.responses = [(302, {'Location': '/y?z=1'}, b'')]
+        response = self.pool.request(self.url)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.url, f'http://{self.address}/y?z=1')
+
+    def test_decompresses_bodies(self) -> None:
+        raw_deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        _FakeServer.responses = [
+            (200, {'Content-Encoding': 'gzip'}, gzip.compress(b'gz')),
+            (200, {'Content-Encoding': 'deflate'}, zlib.compress(b'zl')),
+            (200, {'Content-Encoding': 'deflate'},
+             raw_deflate.compress(b'raw') + raw_deflate.flush())]
+        self.assertEqual(self.pool.request(self.url).body, b'gz')
+        self.assertEqual(self.pool.request(self.url).body, b'zl')
+        self.assertEqual(self.pool.request(self.url).body, b'raw')
+        self.assertIn('gzip', _FakeServer.requests[0][1]['Accept-Encoding'])
+
+    def test_bad_compressed_body(self) -> None:
+        _FakeServer.responses = [(200, {'Content-Encoding': 'gzip'}, b'no')]
+        with self.assertRaises(http_pool.ContentDecodingError):
+            self.pool.request(self.url)
+
+    def test_http_proxy(self) -> None:
+        pool = http_pool.ConnectionPool(proxies={
+            'http': f'http://user:pa%20ss@{self.address}'})
+        pool.request('http://example.invalid/a?b=1')
+        path, headers, port = _FakeServer.requests[0]
+        self.assertEqual(path, 'http://example.invalid/a?b=1')
+        self.assertEqual(headers['Host'], 'example.invalid')
+        self.assertEqual(headers['Proxy-Authorization'],
+                         'Basic dXNlcjpwYSBzcw==')
+
+    def test_https_is_tunnelled_through_proxy(self) -> None:
+        pool = http_pool.ConnectionPool(proxies={'https': self.address})
+        with self.assertRaises(OSError):
+            pool.request('https://example.invalid/a')
+        self.assertEqual(_FakeServer.requests[0][0], 'example.invalid:443')
+
+    def test_no_proxy(self) -> None:
+        pool = http_pool.ConnectionPool(proxies={
+            'http': 'http://proxy.invalid:3128', 'no': '127.0.0.1'})
+        self.assertEqual(pool.request(self.url).status, 200)
+        self.assertEqual(_FakeServer.requests[0][0], '/x')
+
+
+class SendRequestTest(_ServerTest):
+    '''how class_utils.send_request turns pool responses into errors'''
+    def setUp(self) -> None:
+        super().setUp()
+        self.policy = http_retry.RetryPolicy(max_attempts=1)
+
+    def send(self, url: str = None) -> tuple:
+        return class_utils.send_request(urllib.request.Request(
+            url or self.url), self.pool, retry_policy=self.policy)
+
+    def assert_failure(self, api_error: str, status_code: int,
+                       url: str = None) -> None:
+        with self.assertRaises(program_errors.ApiFailureError) as context:
+            self.send(url)
+        self.assertEqual(context.exception.api_error, api_error)
+        self.assertEqual(context.exception.status_code, status_code)
+
+    def test_ok(self) -> None:
+        self.assertEqual(self.send(), ({'ok': True}, self.url))
+
+    def test_not_200(self) -> None:
+        _FakeServer.responses = [(404, {}, b'{}')]
+        self.assert_failure('NOT 200', 404)
+
+    def test_not_json(self) -> None:
+        _FakeServer.responses = [(200, {}, b'<html>')]
+        self.assert_failure('FORMAT', 200)
+
+    def test_bad_compressed_body(self) -> None:
+        _FakeServer.responses = [(200, {'Content-Encoding': 'gzip'}, b'no')]
+        self.assert_failure('FORMAT', 200)
+
+    def test_network(self) -> None:
+        server = http.server.HTTPServer(('127.0.0.1', 0), _FakeServer)
+        url = f'http://127.0.0.1:{server.server_address[1]}/x'
+        server.server_close()
+        self.assert_failure('NETWORK', None, url)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import http.server
+import http_pool
+import http_retry
+import threading
+import time
+import unittest
+
+
+class _FakeServer(http.server.BaseHTTPRequestHandler):
+    '''answers with the next (status, headers, body) in responses, or a 200
+    once they run out. delay is how long to wait before answering'''
+    protocol_version = 'HTTP/1.1'
+    responses = []
+    delay = 0
+    requests = 0
+
+    def do_GET(self) -> None:
+        #the response is taken before waiting, so a slow request left over
+        #from one test can't take a response meant for the next one
+        _FakeServer.requests += 1
+        if _FakeServer.responses:
+            status, headers, body = _FakeServer.responses.pop(0)
+        else:
+            status, headers, body = (200, {}, b'{}')
+        if _FakeServer.delay:
+            time.sleep(_FakeServer.delay)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class _CountingLimiter:
+    def __init__(self):
+        self.tokens_taken = 0
+
+    def acquire(self) -> None:
+        self.tokens_taken += 1
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RetryPolicyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     _FakeServer)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/x'
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        _FakeServer.responses = []
+        _FakeServer.delay = 0
+        _FakeServer.requests = 0
+        self.pool = http_pool.ConnectionPool()
+        self.sleeps = []
+
+    def make_policy(self, **options) -> http_retry.RetryPolicy:
+        return http_retry.RetryPolicy(sleep=self.sleeps.append,
+                                      random_number=lambda: 1.0, **options)
+
+    def test_retries_until_success(self) -> None:
+        _FakeServer.responses = [(503, {'Retry-After': '2'}, b''),
+                                 (502, {}, b'')]
+        policy = self.make_policy(base_delay=0.5)
+        response = policy.send(self.pool, self.url, {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.sleeps, [2.0, 1.0])
+
+    def test_returns_last_response_after_max_attempts(self) -> None:
+        _FakeServer.responses = [(503, {}, b'')] * 3
+        policy = self.make_policy(max_attempts=3)
+        self.assertEqual(policy.send(self.pool, self.url, {}).status, 503)
+        self.assertEqual(_FakeServer.requests, 3)
+
+    def test_long_retry_after_is_not_waited_for(self) -> None:
+        _FakeServer.responses = [(429, {'Retry-After': '120'}, b'')]
+        policy = self.make_policy(max_retry_after=30)
+        self.assertEqual(policy.send(self.pool, self.url, {}).status, 429)
+        self.assertEqual(self.sleeps, [])
+
+    def test_retries_take_rate_limit_tokens(self) -> None:
+        _FakeServer.responses = [(503, {}, b''), (503, {}, b'')]
+        limiter = _CountingLimiter()
+        policy = self.make_policy(rate_limiter=limiter)
+        policy.send(self.pool, self.url, {})
+        self.assertEqual(limiter.tokens_taken, 2)
+
+    def test_breaker_opens_and_recovers(self) -> None:
+        _FakeServer.responses = [(500, {}, b'')] * 2
+        policy = self.make_policy(max_attempts=1, failure_threshold=2,
+                                  reset_timeout=30)
+        clock = _Clock()
+        policy.get_breaker(self.url).clock = clock
+        policy.send(self.pool, self.url, {})
+        policy.send(self.pool, self.url, {})
+        with self.assertRaises(http_retry.CircuitOpenError):
+            policy.send(self.pool, self.url, {})
+        self.assertEqual(_FakeServer.requests, 2)
+
+        clock.now = 31
+        self.assertEqual(policy.send(self.pool, self.url, {}).status, 200)
+        self.assertEqual(policy.get_breaker(self.url).get_state(), 'closed')
+
+    def test_failed_trial_that_raises_does_not_stick(self) -> None:
+        _FakeServer.responses = [(500, {}, b''),
+                                 (200, {'Content-Encoding': 'gzip'}, b'bad')]
+        policy = self.make_policy(max_attempts=1, failure_threshold=1,
+                                  reset_timeout=30)
+        clock = _Clock()
+        breaker = policy.get_breaker(self.url)
+        breaker.clock = clock
+        policy.send(self.pool, self.url, {})
+        self.assertEqual(breaker.get_state(), 'open')
+
+        clock.now = 31
+        with self.assertRaises(http_pool.ContentDecodingError):
+            policy.send(self.pool, self.url, {})
+        self.assertEqual(breaker.get_state(), 'open')
+
+        clock.now = 100
+        self.assertEqual(policy.send(self.pool, self.url, {}).status, 200)
+        self.assertEqual(breaker.get_state(), 'closed')
+
+    def test_hedged_request_answers_first(self) -> None:
+        _FakeServer.delay = 0.5
+        policy = self.make_policy(hedge_after=0.05)
+        start = time.perf_counter()
+        self.assertEqual(policy.send(self.pool, self.url, {}).status, 200)
+        self.assertEqual(_FakeServer.requests, 2)
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_parse_retry_after(self) -> None:
+        self.assertEqual(http_retry.parse_retry_after(' 7 '), 7.0)
+        self.assertEqual(http_retry.parse_retry_after(
+            'Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(http_retry.parse_retry_after('soon'))
+        self.assertIsNone(http_retry.parse_retry_after(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,64 @@
+import forecast_cache
+import gazetteer
 import geocoding
+import http_cache
+import instrumentation
+import os
+import persistent_cache
+import place_index
 import program_errors
+import sqlite3
 import weather_forecast
 import weather_utils
 
+CACHE_DIRECTORY = persistent_cache.CACHE_DIRECTORY
+
+#geocoding results are kept for 30 days
+GEOCODING_CACHE_TTL = 30 * 24 * 60 * 60
+GEOCODING_CACHE_SIZE = 10000
+
+#the nws grid for a location almost never changes
+GRID_CACHE_TTL = 30 * 24 * 60 * 60
+GRID_CACHE_SIZE = 10000
+
+#forecast responses are only reused while the server says they are fresh,
+#or after it confirms they haven't changed, so the ttl is just for cleanup
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60
+RESPONSE_CACHE_SIZE = 200
+
+#forecasts kept in memory for targets in the same grid, mostly useful when
+#one process looks up many targets
+FORECAST_CACHE_SIZE = 256
+FORECAST_CACHE_BYTES = 64 * 1024 * 1024
+
+def open_caches() -> dict:
+    '''opens the on-disk caches: 'geocoding' is shared by the nominatim
+    geocoders, 'grid' remembers the nws forecast url for a location,
+    'responses' keeps nws responses to reuse or revalidate and 'forecasts'
+    keeps decoded forecasts in memory until a newer one should be out. If
+    the cache file can't be made or opened (like a read only home), the
+    program runs without the on-disk caches'''
+    caches = {'forecasts': forecast_cache.ForecastCache(FORECAST_CACHE_SIZE,
+                                                        FORECAST_CACHE_BYTES)}
+    path = os.path.join(CACHE_DIRECTORY, 'cache.sqlite3')
+    try:
+        caches['geocoding'] = persistent_cache.PersistentCache(path,
+            ttl=GEOCODING_CACHE_TTL, max_entries=GEOCODING_CACHE_SIZE,
+            table='geocoding')
+        caches['grid'] = persistent_cache.PersistentCache(path,
+            ttl=GRID_CACHE_TTL, max_entries=GRID_CACHE_SIZE, table='grid')
+        caches['responses'] = http_cache.ResponseCache(
+            persistent_cache.PersistentCache(path, ttl=RESPONSE_CACHE_TTL,
+                max_entries=RESPONSE_CACHE_SIZE, table='responses'))
+    except (OSError, sqlite3.Error):
+        instrumentation.count('cache.open_errors')
+        caches = {'forecasts': caches['forecasts']}
+
+    #hit ratios of the caches show up with the other metrics
+    for name, cache in caches.items():
+        instrumentation.add_collector(f'cache.{name}', cache.stats)
+    return caches
+
 def get_input() -> list[str]:
     '''asks user for input until 'NO MORE QUERIES' is typed, then allows one
     more input'''
@@ -19,33 +75,58 @@ def get_input() -> list[str]:
     return input_list
 
         
-def create_objects_and_attributions(input_list: list) -> tuple:
+FORWARD_GEOCODING_ATTRIBUTION = (
+    '**Forward geocoding data from OpenStreetMap')
+NWS_ATTRIBUTION = ('**Real-time weather data from National Weather Service,'
+                   ' United States Department of Commerce')
+REVERSE_GEOCODING_ATTRIBUTION = (
+    '**Reverse geocoding data from OpenStreetMap')
+
+#where the TARGET, WEATHER and REVERSE lines can get their data from
+TARGET_SOURCES = ('NOMINATIM', 'FILE', 'LOCAL')
+WEATHER_SOURCES = ('NWS', 'FILE')
+REVERSE_SOURCES = ('NOMINATIM', 'FILE', 'LOCAL')
+
+def check_sources(input_list: list) -> None:
+    '''raises ValueError if the TARGET, WEATHER or REVERSE line doesn't name
+    one of the sources it can use'''
+    for input_line, sources in ((input_list[0], TARGET_SOURCES),
+                                (input_list[1], WEATHER_SOURCES),
+                                (input_list[-1], REVERSE_SOURCES)):
+        split_line = input_line.split()
+        if len(split_line) < 2 or split_line[1] not in sources:
+            raise ValueError(f'{input_line!r} needs one of '
+                             f'{", ".join(sources)}')
+
+def create_objects_and_attributions(input_list: list,
+                                    caches: dict = None) -> tuple:
     '''creates objects based on if the input specified a file or api to do
     each task, and adds attributions if the respective api was used. Returns
-    a tuple of the 3 objects and the attribution list'''
-    attribution_list = []
-
-    FORWARD_GEOCODING_ATTRIBUTION = (
-        '**Forward geocoding data from OpenStreetMap')
-    NWS_ATTRIBUTION = ('**Real-time weather data from National Weather Service,'
-                       ' United States Department of Commerce')
-    REVERSE_GEOCODING_ATTRIBUTION = (
-        '**Reverse geocoding data from OpenStreetMap')
+    a tuple of the 3 objects and the attribution list. caches is a dict
+    like the one from open_caches, any cache missing from it isn't used'''
+    if caches is None:
+        caches = {}
+    check_sources(input_list)
     
     first_line = input_list[0].split()
     if first_line[1] == 'NOMINATIM':
         forward_geocoder = geocoding.ForwardGeocodingWithApi(
-            ' '.join(first_line[2:]))
-        attribution_list.append(FORWARD_GEOCODING_ATTRIBUTION)
+            ' '.join(first_line[2:]), cache=caches.get('geocoding'))
     elif first_line[1] == 'FILE':
         forward_geocoder = geocoding.ForwardGeocodingWithFile(first_line[2])
+    elif first_line[1] == 'LOCAL':
+        forward_geocoder = geocoding.ForwardGeocodingWithIndex(
+            ' '.join(first_line[3:]), place_index.open_place_index(
+                first_line[2]), cache=caches.get('geocoding'))
 
     second_line = input_list[1].split()
     if second_line[1] == 'NWS':
         weather_finder = (weather_forecast.WeatherForecastWithApi(
                           forward_geocoder.get_coordinates()[0],
-                          forward_geocoder.get_coordinates()[1]))
-        attribution_list.append(NWS_ATTRIBUTION)
+                          forward_geocoder.get_coordinates()[1],
+                          grid_cache=caches.get('grid'),
+                          response_cache=caches.get('responses'),
+                          forecast_cache=caches.get('forecasts')))
     elif second_line[1] == 'FILE':
         weather_finder = weather_forecast.WeatherForecastWithFile(
             second_line[2])
@@ -53,17 +134,49 @@ def create_objects_and_attributions(input_list: list) -> tuple:
     last_line = input_list[-1].split()
     if last_line[1] == 'NOMINATIM':
         reverse_geocoder = geocoding.ReverseGeocodingWithApi(
-            weather_finder.average_coordinates())
+            weather_finder.average_coordinates(), cache=caches.get('geocoding'))
+    elif last_line[1] == 'FILE':
+        reverse_geocoder = geocoding.ReverseGeocodingWithFile(last_line[2])
+    elif last_line[1] == 'LOCAL':
+        reverse_geocoder = geocoding.ReverseGeocodingWithIndex(
+            weather_finder.average_coordinates(),
+            gazetteer.load_gazetteer(last_line[2]),
+            cache=caches.get('geocoding'))
+
+    return (forward_geocoder, weather_finder, reverse_geocoder,
+            get_attribution_list(input_list,
+                used_reverse_api(input_list, reverse_geocoder),
+                used_forward_api(input_list, forward_geocoder)))
 
+def used_forward_api(input_list: list, forward_geocoder) -> bool:
+    '''true if TARGET LOCAL had to ask nominatim for the coordinates'''
+    return (input_list[0].split()[1] == 'LOCAL'
+            and forward_geocoder.used_api())
+
+def used_reverse_api(input_list: list, reverse_geocoder) -> bool:
+    '''true if REVERSE LOCAL had to ask nominatim for the location'''
+    return (input_list[-1].split()[1] == 'LOCAL'
+            and reverse_geocoder.used_api())
+
+def get_attribution_list(input_list: list, reverse_used_api: bool = False,
+                         forward_used_api: bool = False) -> list:
+    '''returns the attributions for the apis the input asks for.
+    reverse_used_api and forward_used_api add the geocoding attributions for
+    local geocoders that fell back to nominatim'''
+    attribution_list = []
+    if input_list[0].split()[1] == 'NOMINATIM' or forward_used_api:
+        attribution_list.append(FORWARD_GEOCODING_ATTRIBUTION)
+
+    if input_list[1].split()[1] == 'NWS':
+        attribution_list.append(NWS_ATTRIBUTION)
+
+    if input_list[-1].split()[1] == 'NOMINATIM' or reverse_used_api:
         if len(attribution_list) == 0:
             attribution_list.append(REVERSE_GEOCODING_ATTRIBUTION)
         else:
             attribution_list.insert(1, REVERSE_GEOCODING_ATTRIBUTION)
-    elif last_line[1] == 'FILE':
-        reverse_geocoder = geocoding.ReverseGeocodingWithFile(last_line[2])
 
-    return (forward_geocoder, weather_finder,
-            reverse_geocoder, attribution_list)
+    return attribution_list
 
 def make_output_list(input_list: list, objects: tuple) -> list:
     '''makes a list of what the output should be and adds any attributions
@@ -83,10 +196,14 @@ def make_output_list(input_list: list, objects: tuple) -> list:
 
     output_list.append(reverse_geocoder.get_location())
 
+    queries = []
     for query in input_list[2:]:
         if query == 'NO MORE QUERIES':
             break
-        output_list.append(weather_utils.process_query(query, weather_finder))
+        queries.append(query)
+    instrumentation.count('queries', len(queries))
+    with instrumentation.span('queries'):
+        output_list += weather_utils.process_queries(queries, weather_finder)
 
     output_list += attribution_list
     return output_list
@@ -128,17 +245,23 @@ def test_program() -> None:
         e.print_failure_message()
     
 
-def run_program() -> None:
-    '''runs program normally'''
-    input_list = get_input()
-
+def get_output_lines(input_list: list, caches: dict = None) -> list[str]:
+    '''returns the lines run_program would print for input_list, which is
+    the failure message if an api or file fails'''
     try:
-        objects = create_objects_and_attributions(input_list)
-        output_list = make_output_list(input_list, objects)
-        print_output_list(output_list)
+        objects = create_objects_and_attributions(input_list, caches)
+        return make_output_list(input_list, objects)
     except (program_errors.ApiFailureError,
             program_errors.FileFailureError) as e:
-        e.print_failure_message()
+        return e.get_failure_message()
+
+def run_program() -> None:
+    '''runs program normally'''
+    export_format = instrumentation.configure_from_environment()
+    input_list = get_input()
+    print_output_list(get_output_lines(input_list, open_caches()))
+    if export_format is not None:
+        instrumentation.export(export_format)
         
         
 if __name__ == '__main__':
@@ -1,41 +1,92 @@
+import array
 import class_utils
-import json
+import datetime
+import forecast_cache
+import forecast_extract
+import forecast_table
+import instrumentation
+import json_decoding
+import math
 import program_errors
 import urllib.request
 
 class WeatherForecastWithFile:
-    '''class if weather is taken from a file'''
-    def __init__(self, file_name: str):
+    '''class if weather is taken from a file. With selective=True only the
+    parts of the file the program uses are decoded, and if max_periods is
+    given the file is only read up to that many periods, so queries can't
+    look further ahead than that'''
+    def __init__(self, file_name: str, selective: bool = False,
+                 max_periods: int = None):
         self.file_name = file_name
+        self.selective = selective or max_periods is not None
+        self.max_periods = max_periods
         self.json_data = self.get_json_data()
+        self._forecast_table = None
+        self._coordinates = None
+        self._average_coordinates = {}
         
     def get_json_data(self) -> dict:
         '''tries to convert file into a dict, raises error if file is not
         found or not in json format'''
         try:
-            with open(self.file_name, 'r') as file:
-                json_data = json.loads(file.read())
-                return json_data
+            if self.selective:
+                return forecast_extract.load_forecast_file(self.file_name,
+                                                           self.max_periods)
+            return json_decoding.load_file(self.file_name)
         except FileNotFoundError:
-            raise api_utils.FileFailureError(self.file_name, 'missing')
-        except json.JSONDecodeError:
+            raise program_errors.FileFailureError(self.file_name, 'missing')
+        except ValueError:
             raise program_errors.FileFailureError(self.file_name, 'format')
 
     def get_weather_list(self, num_of_iterations: int) -> list:
         '''calls _get_weather_list to make a weather list based on the file data
         and num_of_iterations, which determines the length of the list'''
-        return _get_weather_list(self.json_data, num_of_iterations,
-                                 path=self.file_name)
+        return self.get_forecast_table(num_of_iterations).get_weather_list()
+
+    def get_forecast_table(self, num_of_iterations: int = None
+                           ) -> forecast_table.ForecastTable:
+        '''builds the forecast table from the file data the first time it is
+        asked for, then returns the first num_of_iterations periods of it'''
+        if self._forecast_table is None:
+            with instrumentation.span('forecast.parse'):
+                self._forecast_table = _get_forecast_table(self.json_data,
+                                                           path=self.file_name)
+            self._release_json_data()
+        if num_of_iterations is None:
+            return self._forecast_table
+        return self._forecast_table.prefix(num_of_iterations)
 
     def get_coordinate_list(self) -> list:
         '''calls _get_coordinate_list to get a list of the coordinates that
         show the area covered by the weather station'''
-        return _get_coordinate_list(self.json_data, path = self.file_name)
+        return _get_coordinate_list(self.get_coordinate_array())
+
+    def get_coordinate_array(self) -> array.array:
+        '''decodes the coordinates of the weather station area the first
+        time they are asked for, see _get_coordinate_array'''
+        if self._coordinates is None:
+            self._coordinates = _get_coordinate_array(self.json_data,
+                                                      path = self.file_name)
+            self._release_json_data()
+        return self._coordinates
 
-    def average_coordinates(self) -> tuple:
+    def average_coordinates(self, area_weighted: bool = False) -> tuple:
         '''calls _get_average_coordinates to get the average latitude and
-        longitude of the coordinates from the coordinate list'''
-        return _get_average_coordinates(self.get_coordinate_list())
+        longitude of the coordinates from the coordinate list, or
+        _get_centroid for the center of the area if area_weighted is true.
+        The answer is worked out once'''
+        if area_weighted not in self._average_coordinates:
+            self._average_coordinates[area_weighted] = (
+                _get_centroid(self.get_coordinate_array()) if area_weighted
+                else _get_average_coordinates(self.get_coordinate_array()))
+        return self._average_coordinates[area_weighted]
+
+    def _release_json_data(self) -> None:
+        '''once the forecast table and coordinates have been made the json
+        isn't needed anymore, and it is most of a forecast's memory'''
+        if (self._forecast_table is not None
+                and self._coordinates is not None):
+            self.json_data = None
 
 class WeatherForecastWithApi:
     FORMAT = 'geo+json'
@@ -45,28 +96,111 @@ class WeatherForecastWithApi:
                 'https://www.ics.uci.edu/~thornton/icsh32/ProjectGuide/'
                 f'/project3/{EMAIL}', 'Accept': f'application/{FORMAT}'})
 
-    def __init__(self, latitude, longitude):
+    def __init__(self, latitude, longitude, grid_cache=None,
+                 response_cache=None, forecast_cache=None, load: bool = True):
         self.latitude, self.longitude = self.round_coordinates(latitude,
                                                                longitude)
-        json_data = self.get_json_data()
-        self.json_data = json_data[0]
-        self.url = json_data[1]
+        self.grid_cache = grid_cache
+        self.response_cache = response_cache
+        self.forecast_cache = forecast_cache
+        self.json_data = None
+        self.url = None
+        self._forecast_table = None
+        self._coordinates = None
+        self._average_coordinates = {}
+        if load:
+            self.load()
+
+    def load(self) -> 'WeatherForecastWithApi':
+        '''gets the forecast from the server, which __init__ does unless load
+        is False'''
+        with instrumentation.span('forecast.fetch'):
+            self.json_data, self.url = self.get_json_data()
+        return self
         
     def get_json_data(self) -> dict:
         '''connects and sends request to server, which returns a new url
         that specifies which weather station to ask for the weather, then
-        sends another request and returns the data'''
+        sends another request and returns the data. If a grid cache was given
+        and it already knows the new url for these coordinates, only the
+        second request is sent. A cached url that gets a 404 is forgotten and
+        looked up again. The grid cache is only written after a lookup, so a
+        location that keeps being used still expires after GRID_CACHE_TTL'''
+        new_url, from_cache = self.get_forecast_url()
+
+        try:
+            json_data, polygon = self._get_forecast(new_url)
+        except program_errors.ApiFailureError as e:
+            if not from_cache or e.status_code != 404:
+                raise
+            self.grid_cache.delete(self._make_cache_key())
+            new_url, from_cache = self.get_forecast_url()
+            json_data, polygon = self._get_forecast(new_url)
+
+        if not from_cache:
+            self._cache_grid(new_url, polygon)
+        return json_data
+
+    def _get_forecast(self, new_url: str) -> tuple:
+        '''returns the forecast data and the polygon around its area. With a
+        forecast cache the forecast table and coordinates are taken from the
+        cache instead, so the data is just (None, new_url)'''
+        if self.forecast_cache is None:
+            json_data = self._send_request(self._make_request(new_url))
+            return (json_data, _get_polygon(json_data[0]))
+
+        cached = self.forecast_cache.get(new_url, self._fetch_forecast)
+        return self._use_cached_forecast(new_url, cached)
+
+    def _use_cached_forecast(self, new_url: str,
+                             cached: forecast_cache.CachedForecast) -> tuple:
+        '''takes the forecast table and coordinates from a cached forecast
+        and returns what _get_forecast returns for it'''
+        self._forecast_table = cached.forecast_table
+        self._coordinates = cached.coordinates
+        return ((None, new_url), cached.polygon)
+
+    def _fetch_forecast(self, new_url: str) -> forecast_cache.CachedForecast:
+        '''sends the forecast request and builds what the forecast cache
+        keeps from the response'''
+        json_data, url = self._send_request(self._make_request(new_url))
+        return _make_cached_forecast(json_data, url)
+
+    def get_forecast_url(self) -> tuple:
+        '''returns the forecastHourly url for the coordinates and whether it
+        came from the grid cache'''
+        new_url = self._get_cached_forecast_url()
+        if new_url is not None:
+            return (new_url, True)
+
         url = self._make_url()
         request = self._make_request(url)
         json_data = self._send_request(request)
-        
-        
-        new_url = class_utils.access_json_data(json_data,
+        return (self._get_forecast_url_from(json_data, request), False)
+
+    def _get_forecast_url_from(self, json_data: tuple,
+                               request: urllib.request.Request) -> str:
+        '''picks the forecastHourly url out of the points response'''
+        return class_utils.access_json_data(json_data,
             [0, 'properties', 'forecastHourly'], url=request.full_url)
-        
-        request = self._make_request(new_url)
-        json_data = self._send_request(request)
-        return json_data
+
+    def _get_cached_forecast_url(self) -> str:
+        '''returns the forecastHourly url from the grid cache, or None'''
+        if self.grid_cache is None:
+            return None
+        grid = self.grid_cache.get(self._make_cache_key())
+        if grid is None:
+            return None
+        return grid['forecastHourly']
+
+    def _cache_grid(self, new_url: str, polygon: list) -> None:
+        '''remembers the forecast url and polygon for these coordinates'''
+        if self.grid_cache is not None:
+            self.grid_cache.set(self._make_cache_key(),
+                {'forecastHourly': new_url, 'polygon': polygon})
+
+    def _make_cache_key(self) -> str:
+        return f'points:{self.latitude},{self.longitude}'
     
     def _make_url(self):
         '''API specification of url to connect to'''
@@ -78,8 +212,10 @@ class WeatherForecastWithApi:
         return urllib.request.Request(url, headers = self.HEADERS)
     
     def _send_request(self, request: urllib.request.Request) -> dict:
-        '''calls class_utils to send the request and handle any errors'''
-        return class_utils.send_request(request)
+        '''calls class_utils to send the request and handle any errors. The
+        response cache, if there is one, lets unchanged forecasts be reused'''
+        return class_utils.send_request(request,
+                                        response_cache=self.response_cache)
     
     def round_coordinates(self, latitude: float, longitude: float) -> tuple:
         '''rounds the coordinates before adding them to the url per API
@@ -90,84 +226,196 @@ class WeatherForecastWithApi:
 
     def get_weather_list(self, num_of_iterations: int) -> list:
         '''asks _get_weather_list for the weather list'''
-        return _get_weather_list(self.json_data, num_of_iterations,
-                                 url=self.url)
+        return self.get_forecast_table(num_of_iterations).get_weather_list()
+
+    def get_forecast_table(self, num_of_iterations: int = None
+                           ) -> forecast_table.ForecastTable:
+        '''builds the forecast table from the server data the first time it is
+        asked for, then returns the first num_of_iterations periods of it'''
+        if self._forecast_table is None:
+            with instrumentation.span('forecast.parse'):
+                self._forecast_table = _get_forecast_table(self.json_data,
+                                                           url=self.url)
+            self._release_json_data()
+        if num_of_iterations is None:
+            return self._forecast_table
+        return self._forecast_table.prefix(num_of_iterations)
 
     def get_coordinate_list(self) -> list:
         '''asks _get_coordinate_list for the coordinates representing the
         area of the weather station'''
-        return _get_coordinate_list(self.json_data, self.url)
+        return _get_coordinate_list(self.get_coordinate_array())
+
+    def get_coordinate_array(self) -> array.array:
+        '''decodes the coordinates of the weather station area the first
+        time they are asked for, see _get_coordinate_array'''
+        if self._coordinates is None:
+            self._coordinates = _get_coordinate_array(self.json_data,
+                                                      url = self.url)
+            self._release_json_data()
+        return self._coordinates
 
-    def average_coordinates(self) -> list:
+    def average_coordinates(self, area_weighted: bool = False) -> tuple:
         '''gets the average latitude and longitude of the weather station
-        points'''
-        return _get_average_coordinates(self.get_coordinate_list())
+        points, or the center of its area if area_weighted is true. The
+        answer is worked out once'''
+        if area_weighted not in self._average_coordinates:
+            self._average_coordinates[area_weighted] = (
+                _get_centroid(self.get_coordinate_array()) if area_weighted
+                else _get_average_coordinates(self.get_coordinate_array()))
+        return self._average_coordinates[area_weighted]
+
+    def _release_json_data(self) -> None:
+        '''once the forecast table and coordinates have been made the json
+        isn't needed anymore, and it is most of a forecast's memory'''
+        if (self._forecast_table is not None
+                and self._coordinates is not None):
+            self.json_data = None
 
     
+def _make_cached_forecast(json_data: dict, url: str
+                          ) -> forecast_cache.CachedForecast:
+    '''builds what the forecast cache keeps from a forecast response'''
+    with instrumentation.span('forecast.parse'):
+        weather_table = _get_forecast_table(json_data, url=url)
+    return forecast_cache.CachedForecast(weather_table,
+        _get_coordinate_array(json_data, url=url), _get_polygon(json_data),
+        forecast_cache.get_forecast_expiry(json_data))
+
 def _get_weather_list(json_data: dict, num_of_iterations: int, url=None,
                       path=None) -> list:
     '''creates a weather list that includes temperature, humidity, wind,
     and precipitation with a specified length of num_of_iterations'''
-    weather_list = []
+    return _get_forecast_table(json_data, url=url, path=path,
+        num_of_periods=num_of_iterations).get_weather_list()
 
+def _get_forecast_table(json_data: dict, url=None, path=None,
+                        num_of_periods: int = None
+                        ) -> forecast_table.ForecastTable:
+    '''walks the periods once and copies the start time, temperature,
+    humidity, wind and precipitation of each one into a forecast table. Only
+    the first num_of_periods periods are read if it is given'''
     used_data = class_utils.access_json_data(json_data,
         ['properties', 'periods'], url=url, path=path)
 
-    max_iterations = len(used_data)
-    if max_iterations < num_of_iterations:
-        num_of_iterations = max_iterations
-
-    for period_num in range(num_of_iterations):
-        time = class_utils.access_json_data(used_data,
-            [period_num, 'startTime'], url=url, path=path)
-        temp = class_utils.access_json_data(used_data,
-            [period_num, 'temperature'], url=url, path=path)
-        humidity = class_utils.access_json_data(used_data,
-            [period_num, 'relativeHumidity', 'value'], url=url, path=path)
-        wind = class_utils.access_json_data(used_data,
-            [period_num, 'windSpeed'], url=url, path=path)
-        precipitation =  class_utils.access_json_data(used_data,
-            [period_num, 'probabilityOfPrecipitation', 'value'], url=url,
-                                                      path=path)
+    max_periods = len(used_data)
+    if num_of_periods is None or max_periods < num_of_periods:
+        num_of_periods = max_periods
+
+    start_times = []
+    timestamps = array.array('q')
+    columns = forecast_table.make_empty_columns()
+    temperatures = columns['TEMPERATURE']
+    humidities = columns['HUMIDITY']
+    winds = columns['WIND']
+    precipitations = columns['PRECIPITATION']
+    to_float = forecast_table.to_float
+
+    for period_num in range(num_of_periods):
+        period = class_utils.access_json_data(used_data, [period_num],
+                                              url=url, path=path)
+        time = class_utils.access_json_data(period, ['startTime'], url=url,
+                                            path=path)
+        temp = class_utils.access_json_data(period, ['temperature'],
+                                            url=url, path=path)
+        humidity = class_utils.access_json_data(period,
+            ['relativeHumidity', 'value'], url=url, path=path)
+        wind = class_utils.access_json_data(period, ['windSpeed'], url=url,
+                                            path=path)
+        precipitation = class_utils.access_json_data(period,
+            ['probabilityOfPrecipitation', 'value'], url=url, path=path)
 
         #changes wind = '20.6 mph' to wind = 20.6 (for example)
         if wind != '':
             wind = class_utils.access_json_data(wind.split(), [0], url=url,
                                                 path=path, cast = float)
 
-        #important: this order is used later to access specific info
-        weather_list.append([time, temp, humidity, wind, precipitation])
-                                
-    return weather_list
-
-def _get_coordinate_list(json_data: dict, path:str = None,
-                         url:str = None) -> list:
-    '''gets a coordinate list from the weather station area'''
-    coordinate_list = []
-    for coordinate in class_utils.access_json_data(json_data,
-        ['geometry', 'coordinates', 0], path = path, url = url):
-        
-        coordinate_list.append([
-            class_utils.access_json_data(coordinate, [0], path = path,
-                                            url = url, cast = float),
-            class_utils.access_json_data(coordinate, [1], path = path,
-                                         url = url, cast = float)]),
-        
-    return coordinate_list
+        start_times.append(time)
+        timestamps.append(class_utils.access_json_data([time], [0], url=url,
+            path=path, cast=_parse_timestamp))
+        temperatures.append(to_float(temp))
+        humidities.append(to_float(humidity))
+        winds.append(to_float(wind))
+        precipitations.append(to_float(precipitation))
 
-def _get_average_coordinates(coordinate_list) -> tuple:
-    '''gets the average coordinate of the weather station area'''
-    unique_coordinate_list = list(set(tuple(c) for c in coordinate_list))
+    return forecast_table.ForecastTable(start_times, timestamps, columns)
 
-    lat_values = []
-    lon_values = []
-    for coordinate in unique_coordinate_list:
-        #coordinates are given as longitude, latitude pairs
-        lat_values.append(coordinate[1])
-        lon_values.append(coordinate[0])
+def _parse_timestamp(time: str) -> int:
+    '''turns an iso start time into seconds since the epoch'''
+    return int(datetime.datetime.fromisoformat(time).timestamp())
+
+def _get_coordinate_list(coordinates: array.array) -> list:
+    '''gets a coordinate list of [longitude, latitude] pairs from the
+    weather station area'''
+    return [[coordinates[index], coordinates[index + 1]]
+            for index in range(0, len(coordinates), 2)]
+
+def _get_coordinate_array(json_data: dict, path:str = None,
+                          url:str = None) -> array.array:
+    '''decodes the ring of coordinates around the weather station area into
+    one flat array of floats: longitude, latitude, longitude, latitude...'''
+    return class_utils.access_json_data(json_data,
+        ['geometry', 'coordinates', 0], path = path, url = url,
+        cast = _to_coordinate_array)
+
+def _to_coordinate_array(ring: list) -> array.array:
+    coordinates = array.array('d')
+    for coordinate in ring:
+        coordinates.append(float(coordinate[0]))
+        coordinates.append(float(coordinate[1]))
+    return coordinates
+
+def _get_polygon(json_data: dict) -> list:
+    '''returns the polygon around the forecast area, or None if the data
+    doesn't have one'''
+    try:
+        return json_data['geometry']['coordinates']
+    except (KeyError, TypeError):
+        return None
+
+def _get_average_coordinates(coordinates: array.array) -> tuple:
+    '''gets the average coordinate of the weather station area. Each corner
+    is counted once even though the ring repeats its first corner at the
+    end'''
+    #coordinates are given as longitude, latitude pairs. The set is summed in
+    #its own order, the same order it always has been, since the averages
+    #often land right between two 4 decimal answers and a different order
+    #can round them the other way
+    unique_coordinates = set(zip(coordinates[0::2], coordinates[1::2]))
+
+    average_lat = (sum(lat for lon, lat in unique_coordinates)
+                   / len(unique_coordinates))
+    average_lon = (sum(lon for lon, lat in unique_coordinates)
+                   / len(unique_coordinates))
 
-    
-    average_lat = sum(lat_values)/len(lat_values)
-    average_lon = sum(lon_values)/len(lon_values)
-    
     return (average_lat, average_lon)
+
+def _get_centroid(coordinates: array.array) -> tuple:
+    '''gets the center of the weather station area, weighting every part of
+    the area the same instead of every corner, which matters for large or
+    irregular areas with their corners bunched up on one side. Uses the
+    shoelace formula, measured from the first corner to keep the products
+    small. Falls back to _get_average_coordinates if the area is empty'''
+    lons = coordinates[0::2]
+    lats = coordinates[1::2]
+    if len(lons) < 3:
+        return _get_average_coordinates(coordinates)
+
+    origin_lon = lons[0]
+    origin_lat = lats[0]
+    xs = [lon - origin_lon for lon in lons]
+    ys = [lat - origin_lat for lat in lats]
+
+    #the ring is closed, so the last corner joins back to the first
+    crosses = [x0 * y1 - x1 * y0 for x0, y0, x1, y1
+               in zip(xs, ys, xs[1:] + xs[:1], ys[1:] + ys[:1])]
+    double_area = math.fsum(crosses)
+    if double_area == 0:
+        return _get_average_coordinates(coordinates)
+
+    centroid_x = math.fsum((x0 + x1) * cross for x0, x1, cross
+                           in zip(xs, xs[1:] + xs[:1], crosses))
+    centroid_y = math.fsum((y0 + y1) * cross for y0, y1, cross
+                           in zip(ys, ys[1:] + ys[:1], crosses))
+    return (origin_lat + centroid_y / (3 * double_area),
+            origin_lon + centroid_x / (3 * double_area))
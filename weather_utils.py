@@ -1,5 +1,7 @@
-import operator
+import array
+import forecast_table
 import datetime
+import sparse_table
 
 def feels_like_temperature(t: float, h: float, w: float) -> float:
     '''finds the 'feels like' temperature using temperature(F), humidity(%),
@@ -37,45 +39,156 @@ def celsius_to_fahrenheit(t: float) -> float:
 def fahrenheit_to_celsius(t: float) -> float:
     return (t - 32) * 5 / 9
 
+def feels_like_temperature_array(t, h, w) -> array.array:
+    '''finds the 'feels like' temperature of whole columns of temperatures,
+    humidities and wind speeds in one pass. The heat index and wind chill
+    formulas are written out here, in the same order as heat_index and
+    wind_chill so the answers are exactly the same, because calling them for
+    every value costs more than the math'''
+    feels_temps = array.array('d')
+    append = feels_temps.append
+    for temp, humidity, wind in zip(t, h, w):
+        if temp >= 68:
+            temp_squared = temp**2
+            humidity_squared = humidity**2
+            append(-42.379
+                   + 2.04901523 * temp
+                   + 10.14333127 * humidity
+                   + -0.22475541 * temp * humidity
+                   + -0.00683783 * temp_squared
+                   + -0.05481717 * humidity_squared
+                   + 0.00122874 * temp_squared * humidity
+                   + 0.00085282 * temp * humidity_squared
+                   + -0.00000199 * temp_squared * humidity_squared)
+        elif temp <= 50 and wind > 3:
+            wind_power = wind**0.16
+            append(35.74
+                   + 0.6215 * temp
+                   + -35.75 * wind_power
+                   + 0.4275 * temp * wind_power)
+        else:
+            append(temp)
+    return feels_temps
+
+def heat_index_array(t, h) -> array.array:
+    '''runs heat_index over whole columns of temperatures and humidities'''
+    return array.array('d', map(heat_index, t, h))
+
+def wind_chill_array(t, w) -> array.array:
+    '''runs wind_chill over whole columns of temperatures and wind speeds'''
+    return array.array('d', map(wind_chill, t, w))
+
+def fahrenheit_to_celsius_array(t) -> array.array:
+    '''converts a whole column of fahrenheit temperatures to celsius'''
+    return array.array('d', map(fahrenheit_to_celsius, t))
+
 def process_query(query, weather_finder: list) -> str:
     '''for each query line, the query is split up into its components and
     the response is returned'''
+    weather_type, series, start, end, limit = parse_query(query)
+    weather_table = weather_finder.get_forecast_table(end)
+    values = get_query_values(weather_table, series)
+    start = max(0, min(start, len(values)))
+    period_num = start + find_extreme_index(values[start:], limit)
+    return format_processed_query(weather_table, values, period_num,
+                                  weather_type)
+
+def process_queries(queries: list, weather_finder) -> list[str]:
+    '''answers a whole list of queries in one pass. Queries are grouped by
+    the values they look at and by MAX/MIN, and each group gets one running
+    max/min scan of the full table, so every 'N MAX'/'N MIN' query is a
+    lookup. Groups with 'START:END' queries also get a SparseTable, so those
+    are lookups too. The answers are the same as calling process_query on
+    each one'''
+    weather_table = weather_finder.get_forecast_table()
+    query_values = {}
+    running_indexes = {}
+    sparse_tables = {}
+    processed_queries = []
+
+    for query in queries:
+        weather_type, series, start, end, limit = parse_query(query)
+
+        if series not in query_values:
+            query_values[series] = get_query_values(weather_table, series)
+        values = query_values[series]
+
+        #anything that isn't MAX is treated as MIN, same as process_query
+        group = (series, limit == 'MAX')
+        end = max(0, min(end, len(values)))
+        if start <= 0:
+            if group not in running_indexes:
+                running_indexes[group] = running_extreme_indexes(values,
+                                                                 limit)
+            period_num = running_indexes[group][end - 1] if end > 0 else -1
+        else:
+            if group not in sparse_tables:
+                sparse_tables[group] = sparse_table.SparseTable(values, limit)
+            period_num = sparse_tables[group].find(start, end)
+
+        if period_num == -1:
+            raise ValueError(f'no weather values to find the '
+                             f'{limit.lower()} of')
+
+        processed_queries.append(format_processed_query(weather_table,
+            values, period_num, weather_type))
+
+    return processed_queries
+
+def parse_query(query: str) -> tuple:
+    '''splits a query line into its weather type, the series of values it
+    looks at, the periods it looks at and MAX/MIN. The series is a tuple like
+    ('TEMPERATURE', 'FEELS', 'C') or ('WIND',). The periods are either N,
+    the first N periods, or START:END, periods START up to but not including
+    END (so 24 is the same as 0:24), and are returned as start and end'''
     split_query = query.split()
     limit = split_query[-1]
-    length = int(split_query[-2])
+    start, end = parse_period_range(split_query[-2])
     weather_type = split_query[0]
-    weather_list = weather_finder.get_weather_list(length)
-    specific_weather_list = []
-    
+
     if weather_type == 'TEMPERATURE':
-        temp_scale = split_query[2]
-        temp_type = split_query[1]
+        temp_type = 'FEELS' if split_query[1] == 'FEELS' else 'AIR'
+        temp_scale = 'C' if split_query[2] == 'C' else 'F'
+        series = (weather_type, temp_type, temp_scale)
+    else:
+        series = (weather_type,)
+
+    return (weather_type, series, start, end, limit)
+
+def parse_period_range(period_range: str) -> tuple:
+    '''reads the N or START:END part of a query as (start, end)'''
+    if ':' not in period_range:
+        return (0, int(period_range))
+    start, end = period_range.split(':')
+    return (int(start), int(end))
+
+def get_query_values(weather_table, series: tuple):
+    '''returns the values of a series from parse_query for every period in
+    the forecast table'''
+    weather_type = series[0]
+    if weather_type == 'TEMPERATURE':
+        temp_type, temp_scale = series[1:]
         
         if temp_type == 'FEELS':
-            specific_weather_list = calculate_feels_temps(weather_list)
-
+            values = calculate_feels_column(weather_table)
         else:
-            specific_weather_list = get_specific_weather_list(weather_list,
-                                                      weather_type)
+            values = weather_table.column(weather_type)
 
         if temp_scale == 'C':
-            specific_weather_list = calculate_celsius_list(
-                specific_weather_list)
+            values = fahrenheit_to_celsius_array(values)
         
-    else:
-        specific_weather_list = get_specific_weather_list(weather_list,
-                                                      weather_type)
-    
-    if limit == 'MAX':
-        weather_time_value = max(specific_weather_list,
-                                 key = operator.itemgetter(1))
-    else:
-        weather_time_value = min(specific_weather_list,
-                                 key = operator.itemgetter(1))
+        return values
 
-    formatted_date_time = format_date_time(weather_time_value)
+    return weather_table.column(weather_type)
+
+def format_processed_query(weather_table, values, period_num: int,
+                           weather_type: str) -> str:
+    '''formats the answer to a query as the utc start time of the period
+    and its value. The time comes from the timestamp parsed when the table
+    was made instead of parsing the start time string again'''
+    formatted_date_time = weather_table.get_utc_time(period_num)
     
-    processed_query = (f'{formatted_date_time} {weather_time_value[1]:.4f}')
+    processed_query = f'{formatted_date_time} {values[period_num]:.4f}'
     
     weather_percents = {'HUMIDITY', 'PRECIPITATION'}
     if weather_type in weather_percents:
@@ -83,44 +196,108 @@ def process_query(query, weather_finder: list) -> str:
 
     return processed_query
 
-def get_specific_weather_list(weather_list: list, weather_type: str) -> tuple:
-    '''creates a weather list where each elements is a tuple of the date/time
-    of the start of the period and the weather type that is wanted''' 
-    specific_weather_list = []
+def running_extreme_indexes(values, limit: str) -> array.array:
+    '''returns an array where index i holds the index of the first MAX or
+    MIN value in values[:i + 1], or -1 if all of those values are missing'''
+    extreme_indexes = array.array('q')
+    best_index = -1
+    best_value = None
+    is_max = limit == 'MAX'
+    for index, value in enumerate(values):
+        if value == value and (best_index == -1
+                or (is_max and value > best_value)
+                or (not is_max and value < best_value)):
+            best_index = index
+            best_value = value
+        extreme_indexes.append(best_index)
+    return extreme_indexes
 
-    #same order as weather_forecast line 144
-    weather_codes = {'TEMPERATURE': 1, 'HUMIDITY': 2, 'WIND': 3,
-                     'PRECIPITATION': 4}
-    
-    for period in weather_list:
-        if (period[weather_codes[weather_type]] != '' and
-            type(period[weather_codes[weather_type]]) == int or
-             type(period[weather_codes[weather_type]]) == float):
-            #time is always included as period[0]
-            specific_weather_list.append([period[0], period[weather_codes[
-                weather_type]]])
+def rolling_extremes(weather_table, query: str, window: int,
+                     step: int = 1) -> list[str]:
+    '''answers a query (like 'WIND 0:72 MAX') over every window periods of
+    its range, starting a new window every step periods, so
+    rolling_extremes(table, 'TEMPERATURE AIR F 168 MAX', 24, 24) is the
+    highest temperature of each day. Windows of only missing values are
+    left out'''
+    weather_type, series, start, end, limit = parse_query(query)
+    values = get_query_values(weather_table, series)
+    start = max(0, min(start, len(values)))
+    end = max(start, min(end, len(values)))
+    extreme_indexes = sparse_table.rolling_extreme_indexes(
+        values[start:end], window, limit, step)
+    return [format_processed_query(weather_table, values, start + index,
+                                   weather_type)
+            for index in extreme_indexes if index != -1]
 
-    return specific_weather_list
+def find_extreme_index(values, limit: str) -> int:
+    '''returns the index of the first MAX or MIN value, skipping missing
+    (nan) values. Raises ValueError like max() and min() do if there are no
+    values'''
+    best_index = None
+    best_value = None
+    for index, value in enumerate(values):
+        if value != value:
+            continue
+        if (best_index is None or (limit == 'MAX' and value > best_value)
+                or (limit != 'MAX' and value < best_value)):
+            best_index = index
+            best_value = value
+
+    if best_index is None:
+        raise ValueError(f'no weather values to find the {limit.lower()} of')
+    return best_index
+
+def get_specific_weather_list(weather_list, weather_type: str) -> list:
+    '''creates a weather list where each elements is a [date/time of the
+    start of the period, value] pair for the weather type that is wanted.
+    weather_list can be a forecast table, whose column is read directly, or
+    a list of periods''' 
+    if isinstance(weather_list, forecast_table.ForecastTable):
+        times_and_values = zip(weather_list.start_times,
+                               weather_list.column(weather_type))
+    else:
+        times_and_values = ((period.start_time,
+                             period.get_value(weather_type))
+                            for period in weather_list)
 
-def calculate_feels_temps(weather_list: list) -> list:
+    #missing values are None in a period and nan in a table
+    return [[time, value] for time, value in times_and_values
+            if (type(value) == int or type(value) == float)
+            and value == value]
+
+def calculate_feels_temps(weather_list) -> list:
     '''calculates the feels like temp from a weather list and returns a list
     of the updated values'''
-    feels_temps = []
-    for period in weather_list:
-        feels_temps.append([period[0], feels_like_temperature(
-            period[1], period[2], period[3])])
-    return feels_temps
+    if isinstance(weather_list, forecast_table.ForecastTable):
+        return [[time, feels_temp] for time, feels_temp in zip(
+            weather_list.start_times, calculate_feels_column(weather_list))]
+
+    feels_temps = feels_like_temperature_array(
+        [period.temperature for period in weather_list],
+        [period.humidity for period in weather_list],
+        [period.wind for period in weather_list])
+    return [[period.start_time, feels_temp] for period, feels_temp
+            in zip(weather_list, feels_temps)]
+
+def calculate_feels_column(weather_table) -> array.array:
+    '''calculates the feels like temp of every period in a forecast table'''
+    return feels_like_temperature_array(weather_table.column('TEMPERATURE'),
+                                        weather_table.column('HUMIDITY'),
+                                        weather_table.column('WIND'))
 
 def calculate_celsius_list(specific_weather_list: list) -> list:
     '''calculates the celsius values of a temp and updates the list with the new
     values'''
-    for index in range(len(specific_weather_list)):
-        specific_weather_list[index][1] = (fahrenheit_to_celsius(
-            specific_weather_list[index][1]))
+    celsius_temps = fahrenheit_to_celsius_array(
+        [period[1] for period in specific_weather_list])
+    for period, celsius_temp in zip(specific_weather_list, celsius_temps):
+        period[1] = celsius_temp
     return specific_weather_list
 
 def format_date_time(weather_time_value: tuple) -> str:
-    '''returns the date and time in specified format with utc time'''
+    '''returns the date and time in specified format with utc time. Forecast
+    tables already have the start times as timestamps, use get_utc_time for
+    those'''
     weather_date_time = weather_time_value[0]
     local_date_time = datetime.datetime.fromisoformat(weather_date_time)
     utc_date_time = local_date_time.astimezone(datetime.timezone.utc)